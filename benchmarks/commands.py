@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Runs CLI commands against the local stub API and reports, per command,
+the wall time, the time to the first line of output, the number of API
+requests, the bytes exchanged and the connections opened.
+
+Usage: python benchmarks/commands.py [--latency MS] [--runs N] [--stream] [--gzip]
+                                     [--services N] [--log-pages N] [command ...]
+
+Commands are given as quoted strings, e.g. 'alias list' 'var set A=1'.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub_api import StubAPI
+from dotcloud.ui import CLI
+
+COMMANDS = (
+    'check',
+    'list',
+    'info',
+    'url',
+    'env list',
+    'alias list',
+    'var list',
+    'var set VAR0=changed',
+    'scale svc0=3 svc1=2',
+    'restart svc0',
+)
+
+class FirstWrite(object):
+    """Discards the command output, remembering when it started."""
+    def __init__(self):
+        self.first = None
+
+    def write(self, data):
+        if self.first is None and data.strip():
+            self.first = time.time()
+
+    def flush(self):
+        pass
+
+def setup_home(home, api):
+    os.mkdir(os.path.join(home, '.dotcloud2'))
+    config = {
+        'token': {'access_token': 'token', 'refresh_token': 'refresh', 'scope': '',
+                  'issued_at': time.time(), 'expires_in': 3600},
+        'client': {'key': 'key', 'secret': 'secret', 'token_url': api.token_url}
+    }
+    json.dump(config, open(os.path.join(home, '.dotcloud2', 'config'), 'w'))
+    os.mkdir(os.path.join(home, '.dotcloud'))
+    json.dump({'application': 'bench', 'environment': 'default'},
+              open(os.path.join(home, '.dotcloud', 'config'), 'w'))
+
+def run_command(api, command):
+    api.reset()
+    out = FirstWrite()
+    stdout, sys.stdout = sys.stdout, out
+    stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+    start = time.time()
+    try:
+        CLI(endpoint=api.endpoint).run(command.split())
+    except SystemExit:
+        pass
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+    end = time.time()
+    first = (out.first or end) - start
+    return dict(api.stats, wall=end - start, first=first)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CLI commands against a stub API')
+    parser.add_argument('--latency', type=float, default=20, help='injected latency per request (ms)')
+    parser.add_argument('--runs', type=int, default=3, help='runs per command (the best one is shown)')
+    parser.add_argument('--services', type=int, default=5)
+    parser.add_argument('--log-pages', type=int, default=3)
+    parser.add_argument('--stream', action='store_true', help='stream the build logs')
+    parser.add_argument('--gzip', action='store_true', help='gzip the JSON responses')
+    parser.add_argument('commands', nargs='*', default=COMMANDS)
+    args = parser.parse_args()
+
+    api = StubAPI(latency=args.latency / 1000.0, services=args.services,
+                  log_pages=args.log_pages, stream_logs=args.stream,
+                  compress=args.gzip).start()
+    home = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        setup_home(home, api)
+        os.environ['HOME'] = home
+        os.chdir(home)
+        sys.argv = ['dotcloud2']
+        print '{0:<24} {1:>9} {2:>9} {3:>5} {4:>6} {5:>9} {6:>9}'.format(
+            'command', 'wall ms', 'first ms', 'reqs', 'conns', 'bytes in', 'bytes out')
+        for command in args.commands:
+            runs = [run_command(api, command) for i in range(args.runs)]
+            best = min(runs, key=lambda r: r['wall'])
+            print '{0:<24} {1:>9.1f} {2:>9.1f} {3:>5} {4:>6} {5:>9} {6:>9}'.format(
+                command, best['wall'] * 1000, best['first'] * 1000, best['requests'],
+                best['connections'], best['bytes_in'], best['bytes_out'])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(home)
+        api.stop()
+
+if __name__ == '__main__':
+    main()
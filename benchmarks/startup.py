@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Measures how long `dotcloud2 app` and `dotcloud2 version` take to run.
+
+Usage: python benchmarks/startup.py [runs]
+
+Each command runs in a fresh interpreter, from a temporary directory
+connected to a fake application, with an empty HOME. The script also
+reports which of the networking modules got imported, as commands that
+don't talk to the API shouldn't load any of them.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('urllib2', 'httplib', 'ssl', 'subprocess', 'getpass', 'base64')
+PROBE = """
+import sys
+sys.path.insert(0, {root!r})
+sys.argv = ['dotcloud2'] + {args!r}
+from dotcloud.ui import CLI
+CLI().run(sys.argv[1:])
+print >>sys.stderr, ' '.join(m for m in {heavy!r} if m in sys.modules)
+"""
+
+def run(args, runs, cwd, env):
+    script = PROBE.format(root=ROOT, args=args, heavy=HEAVY)
+    timings = []
+    for i in range(runs):
+        start = time.time()
+        p = subprocess.Popen([sys.executable, '-c', script], cwd=cwd, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        timings.append(time.time() - start)
+    timings.sort()
+    print '{0:<10} min {1:6.1f}ms  median {2:6.1f}ms  loaded: {3}'.format(
+        ' '.join(args), timings[0] * 1000, timings[len(timings) / 2] * 1000,
+        err.strip().splitlines()[-1] if err.strip() else '-')
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    tmp = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(tmp, '.dotcloud'))
+        json.dump({'application': 'bench', 'environment': 'default'},
+                  open(os.path.join(tmp, '.dotcloud', 'config'), 'w'))
+        env = dict(os.environ, HOME=tmp)
+        run(['version'], 1, tmp, env)  # warm up the bytecode caches
+        for args in (['app'], ['version'], ['env', 'show']):
+            run(args, runs, tmp, env)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
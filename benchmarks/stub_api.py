@@ -0,0 +1,254 @@
+"""A local stand-in for the DotCloud REST API, for benchmarks.
+
+It serves a fake application with a configurable number of services,
+environments, aliases and variables, build logs split in pages linked
+with `next` (or streamed as newline delimited JSON), and the OAuth2 token
+endpoint. Every response can be delayed to simulate network latency, and
+the server counts requests, connections and bytes in both directions.
+JSON responses can be gzipped for clients accepting it.
+"""
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+
+class CountingFile(object):
+    def __init__(self, fp, stats, key):
+        self.fp = fp
+        self.stats = stats
+        self.key = key
+
+    def count(self, data):
+        self.stats[self.key] += len(data)
+        return data
+
+    def read(self, *args):
+        return self.count(self.fp.read(*args))
+
+    def readline(self, *args):
+        return self.count(self.fp.readline(*args))
+
+    def write(self, data):
+        self.fp.write(self.count(data))
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        stats = self.server.stats
+        with self.server.lock:
+            stats['connections'] += 1
+        self.rfile = CountingFile(self.rfile, stats, 'bytes_in')
+        self.wfile = CountingFile(self.wfile, stats, 'bytes_out')
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, code, obj, etag=True):
+        body = json.dumps(obj)
+        tag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+        if etag and self.command == 'GET' and self.headers.get('If-None-Match') == tag:
+            self.send_response(304)
+            self.send_header('ETag', tag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        if self.server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        if etag and self.command == 'GET':
+            self.send_header('ETag', tag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, items, delay):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for item in items:
+            line = json.dumps(item) + '\n'
+            self.wfile.write('{0:x}\r\n{1}\r\n'.format(len(line), line))
+            self.wfile.flush()
+            time.sleep(delay)
+        self.wfile.write('0\r\n\r\n')
+
+    def handle_any(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+        time.sleep(self.server.latency)
+        path, _, query = self.path.partition('?')
+        for method, pattern, func in self.server.routes:
+            m = re.match(pattern + '$', path)
+            if m and method in (self.command, '*'):
+                return func(self, body, query, *m.groups())
+        self.send_json(404, {'error': {'description': 'Not found: ' + path}})
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_any
+
+class StubAPI(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, services=5, environments=3, variables=20,
+                 log_pages=3, log_lines=10, stream_logs=False, compress=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.latency = latency
+        self.log_pages = log_pages
+        self.log_lines = log_lines
+        self.stream_logs = stream_logs
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.reset()
+        self.environments = ['default'] + ['env{0}'.format(i) for i in range(1, environments)]
+        self.services = [self.make_service('svc{0}'.format(i)) for i in range(services)]
+        self.variables = dict(('VAR{0}'.format(i), 'value{0}'.format(i)) for i in range(variables))
+        app = r'/1/me/applications/([^/]+)'
+        env = app + r'/environments/([^/]+)'
+        self.routes = [
+            ('POST', r'/oauth2/token', Handler.token),
+            ('GET', r'/1/me', Handler.me),
+            ('GET', r'/1/me/private_keys', Handler.private_keys),
+            ('GET', r'/1/me/applications', Handler.applications),
+            ('GET', app, Handler.application),
+            ('GET', app + r'/push-url', Handler.push_url),
+            ('GET', app + r'/environments', Handler.environments),
+            ('GET', env + r'/services', Handler.services),
+            ('GET', env + r'/services/([^/]+)', Handler.service),
+            ('GET', env + r'/services/([^/]+)/aliases', Handler.aliases),
+            ('PUT', env + r'/services/([^/]+)/instances', Handler.echo),
+            ('POST', env + r'/services/([^/]+)/reboots', Handler.echo),
+            ('GET', env + r'/variables', Handler.get_variables),
+            ('PATCH', env + r'/variables', Handler.patch_variables),
+            ('PUT', env + r'/revision', Handler.echo),
+            ('GET', env + r'/build_logs', Handler.build_logs),
+        ]
+
+    def make_service(self, name, instances=2):
+        return {
+            'name': name,
+            'instances': [{
+                'config': {'ram': 128},
+                'build_config': {'type': 'python'},
+                'ports': [
+                    {'name': 'http', 'url': 'http://{0}.app.example.com'.format(name)},
+                    {'name': 'ssh', 'url': 'ssh://dotcloud@127.0.0.1:{0}'.format(2200 + i)}
+                ]
+            } for i in range(instances)]
+        }
+
+    def reset(self):
+        self.stats = {'requests': 0, 'connections': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:{0}/1'.format(self.server_address[1])
+
+    @property
+    def token_url(self):
+        return 'http://127.0.0.1:{0}/oauth2/token'.format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def route(func):
+    setattr(Handler, func.__name__, func)
+    return func
+
+@route
+def token(self, body, query):
+    self.send_json(200, {'access_token': 'token', 'refresh_token': 'refresh',
+                         'expires_in': 3600, 'scope': ''}, etag=False)
+
+@route
+def me(self, body, query):
+    self.send_json(200, {'object': {'username': 'bench'}})
+
+@route
+def private_keys(self, body, query):
+    self.send_json(200, {'objects': [{'private_key': 'KEY'}]})
+
+@route
+def applications(self, body, query):
+    self.send_json(200, {'objects': [{'name': 'app{0}'.format(i)} for i in range(10)]})
+
+@route
+def application(self, body, query, app):
+    self.send_json(200, {'object': {'name': app, 'snapshots_enabled': False}})
+
+@route
+def push_url(self, body, query, app):
+    self.send_json(200, {'object': {'url': 'ssh://dotcloud@127.0.0.1:2222/code'}})
+
+@route
+def environments(self, body, query, app):
+    self.send_json(200, {'objects': [{'name': e} for e in self.server.environments]})
+
+@route
+def services(self, body, query, app, env):
+    self.send_json(200, {'objects': self.server.services})
+
+@route
+def service(self, body, query, app, env, name):
+    self.send_json(200, {'object': self.server.make_service(name)})
+
+@route
+def aliases(self, body, query, app, env, name):
+    self.send_json(200, {'objects': [{'alias': '{0}.example.com'.format(name)}]})
+
+@route
+def echo(self, body, query, *args):
+    self.send_json(200, {'object': json.loads(body) if body else {}})
+
+@route
+def get_variables(self, body, query, app, env):
+    self.send_json(200, {'object': self.server.variables})
+
+@route
+def patch_variables(self, body, query, app, env):
+    for key, value in json.loads(body).items():
+        if value is None:
+            self.server.variables.pop(key, None)
+        else:
+            self.server.variables[key] = value
+    self.send_json(200, {'object': self.server.variables})
+
+@route
+def build_logs(self, body, query, app, env):
+    server = self.server
+    page = int(query.partition('page=')[2] or 0)
+    def lines(page):
+        return [{'timestamp': time.time(), 'source': 'www',
+                 'message': 'page {0} line {1}'.format(page, i)}
+                for i in range(server.log_lines)]
+    if server.stream_logs and 'application/x-ndjson' in self.headers.get('Accept', ''):
+        items = [line for p in range(server.log_pages) for line in lines(p)]
+        return self.send_stream(items, server.latency / max(server.log_lines, 1))
+    links = []
+    if page + 1 < server.log_pages:
+        links.append({'rel': 'next', 'href': '{0}{1}?page={2}'.format(
+            server.endpoint[:-2], self.path.partition('?')[0], page + 1)})
+    self.send_json(200, {'objects': lines(page), 'links': links}, etag=False)
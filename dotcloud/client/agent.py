@@ -0,0 +1,210 @@
+import copy
+import json
+import os
+import socket
+import SocketServer
+import sys
+import threading
+import time
+
+from .client import RESTClient
+from .memo import RequestMemo
+from .response import BaseResponse
+from .timing import Timing
+from .errors import (RESTAPIError, AuthenticationNotConfigured,
+                     DeadlineExceeded)
+
+# Protocol: the client sends one JSON object per line, either a command
+# ({"command": "status"} or {"command": "stop"}) or an API request
+# ({"method": "GET", "path": "/me", "payload": null, ...}), and the agent
+# answers each of them with one JSON object on a line.
+
+class AgentHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            reply = self.server.dispatch(json.loads(line))
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+
+class AgentServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Serves the API requests of the CLI processes with one long lived
+    RESTClient, so that its connections, token and caches stay warm.
+
+    `before_request` is called before each request, e.g. to pick up a new
+    token written by another process."""
+    daemon_threads = True
+
+    def __init__(self, path, client, before_request=None):
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.UnixStreamServer.__init__(self, path, AgentHandler)
+        os.chmod(path, 0600)
+        self.path = path
+        self.client = client
+        # Requests are sent by copies of the client: set the shared
+        # connection pool and opener up first.
+        client.opener
+        # Identical GETs sent at the same time by several commands are
+        # collapsed, but responses aren't kept from one command to another.
+        client.memo = RequestMemo(remember=False)
+        self.before_request = before_request
+        self.started = time.time()
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def dispatch(self, message):
+        command = message.get('command')
+        if command == 'status':
+            return {
+                'pid': os.getpid(),
+                'endpoint': self.client.endpoint,
+                'uptime': time.time() - self.started,
+                'requests': self.requests,
+                'connections': self.client.pool.stats
+            }
+        if command == 'stop':
+            # shutdown() waits for serve_forever(), which runs this handler
+            threading.Thread(target=self.shutdown).start()
+            return {}
+        return self.forward(message)
+
+    def forward(self, message):
+        with self.lock:
+            self.requests += 1
+            if self.before_request:
+                self.before_request()
+        # A copy shares the connections, authenticator and cache, but has
+        # its own trace ID, timeouts and timing callbacks.
+        client = copy.copy(self.client)
+        client.trace_id = message.get('trace_id')
+        client.timeout = message.get('timeout')
+        client.deadline = message.get('deadline')
+        timings = []
+        client.timing_callbacks = [timings.append] if message.get('timings') else []
+        reply = {}
+        try:
+            if message['method'] == 'GET':
+                res = client.get(message['path'], memo=message.get('memo', True))
+            else:
+                res = client.request(client.make_request(message['method'], message['path'],
+                                                         message.get('payload')))
+            reply['data'] = res.data if res is not None else None
+        except RESTAPIError, e:
+            reply['error'] = {'type': 'api', 'code': e.code, 'desc': e.desc}
+        except AuthenticationNotConfigured:
+            reply['error'] = {'type': 'auth'}
+        except DeadlineExceeded, e:
+            reply['error'] = {'type': 'deadline', 'desc': str(e)}
+        except IOError, e:
+            reply['error'] = {'type': 'network', 'desc': str(e)}
+        reply['trace_id'] = client.trace_id
+        reply['timings'] = [dict((name, getattr(t, name)) for name in TIMING_FIELDS)
+                            for t in timings]
+        return reply
+
+TIMING_FIELDS = ('method', 'url', 'trace_id', 'status', 'reused', 'cached',
+                 'bytes_saved', 'start', 'phases')
+
+class AgentClient(RESTClient):
+    """RESTClient sending its requests through the agent listening on the
+    Unix socket `path`. Retries, caching and authentication are done by
+    the agent."""
+
+    def __init__(self, path, endpoint='https://rest.dotcloud.com/1', debug=False):
+        RESTClient.__init__(self, endpoint=endpoint, debug=debug)
+        self.path = path
+
+    def call(self, message, timeout=None):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(self.path)
+            f = sock.makefile('r+b')
+            f.write(json.dumps(message) + '\n')
+            f.flush()
+            line = f.readline()
+            f.close()
+        finally:
+            sock.close()
+        if not line:
+            raise socket.error('The agent closed the connection')
+        return json.loads(line)
+
+    def status(self):
+        return self.call({'command': 'status'}, timeout=2)
+
+    def stop(self):
+        return self.call({'command': 'stop'}, timeout=2)
+
+    def forward(self, method, path, payload=None, memo=True):
+        if method != 'GET' and self.memo is not None:
+            # GETs sent before or during a write may be outdated
+            self.memo.clear()
+            try:
+                return self.send_message(method, path, payload, memo)
+            finally:
+                self.memo.clear()
+        return self.send_message(method, path, payload, memo)
+
+    def send_message(self, method, path, payload, memo):
+        timeout = None
+        if self.deadline is not None:
+            timeout = self.request_timeout()
+        if self.debug:
+            print >>sys.stderr, '### {0} {1} (agent)'.format(method, self.build_url(path))
+        reply = self.call({
+            'method': method,
+            'path': path,
+            'payload': payload,
+            'memo': memo,
+            'trace_id': self.trace_id,
+            'timeout': self.timeout,
+            'deadline': self.deadline,
+            'timings': bool(self.timing_callbacks)
+        }, timeout)
+        self.trace_id = reply.get('trace_id')
+        if self.trace:
+            self.trace(self.trace_id)
+        for fields in reply.get('timings', []):
+            timing = Timing(fields['method'], fields['url'], list(self.timing_callbacks))
+            timing.__dict__.update(fields)
+            timing.finish()
+        error = reply.get('error')
+        if error:
+            if error['type'] == 'api':
+                raise RESTAPIError(code=error['code'], desc=error['desc'])
+            if error['type'] == 'auth':
+                raise AuthenticationNotConfigured
+            if error['type'] == 'deadline':
+                raise DeadlineExceeded(error['desc'])
+            import urllib2
+            raise urllib2.URLError(error['desc'])
+        if reply['data'] is None:
+            return None
+        return BaseResponse.create(data=reply['data'])
+
+    def get(self, path, memo=True):
+        return self.memoized(path, memo, lambda: self.forward('GET', path, memo=memo))
+
+    def get_page(self, path):
+        return self.get(path)
+
+    def stream(self, path):
+        # Streamed responses can't go through the agent: ask for a regular
+        # response, which callers of stream() handle too.
+        return self.forward('GET', path, memo=False)
+
+    def post(self, path, payload={}):
+        return self.forward('POST', path, payload)
+
+    def put(self, path, payload={}):
+        return self.forward('PUT', path, payload)
+
+    def delete(self, path):
+        return self.forward('DELETE', path)
+
+    def patch(self, path, payload={}):
+        return self.forward('PATCH', path, payload)
@@ -0,0 +1,139 @@
+import Queue
+import sys
+import threading
+
+from .client import RESTClient
+
+class Future(object):
+    """Result of a request made by AsyncRESTClient."""
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._value = None
+        self._exc_info = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the response and returns it, or raises the error the
+        request failed with (RESTAPIError, URLError...)."""
+        self.wait(timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+    def exception(self, timeout=None):
+        self.wait(timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def wait(self, timeout=None):
+        # Event.wait() without a timeout can't be interrupted with ^C
+        if not self._event.wait(86400 if timeout is None else timeout):
+            raise RuntimeError('Request not completed after {0}s'.format(timeout))
+
+    def add_done_callback(self, func):
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def set_result(self, value):
+        self._value = value
+        self._complete()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._complete()
+
+    def _complete(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+class AsyncRESTClient(object):
+    """Non-blocking counterpart of RESTClient: get/post/put/delete/patch
+    return a Future right away and the requests run on a bounded set of
+    worker threads.
+
+    Requests go through a regular RESTClient, so they share its
+    authenticator, response handling, certificate verification and
+    keep-alive connection pool. Each worker thread has its own trace ID.
+    """
+    def __init__(self, endpoint='https://rest.dotcloud.com/1', debug=False,
+                 workers=8, client=None):
+        self.client = client or RESTClient(endpoint=endpoint, debug=debug,
+                                           pool_size=workers)
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # endpoint, authenticator, trace, trace_id... live on the client
+        return getattr(self.client, name)
+
+    def __setattr__(self, name, value):
+        # Settings (timeout, hedge, memo...) are those of the client too
+        if name in ('client', 'workers') or name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.client, name, value)
+
+    def submit(self, func, *args):
+        future = Future()
+        self._start_workers()
+        self._queue.put((future, func, args))
+        return future
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, func, args = task
+            try:
+                future.set_result(func(*args))
+            except:
+                future.set_exc_info(sys.exc_info())
+
+    def close(self):
+        """Stops the worker threads and closes the idle connections."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+        self.client.pool.clear()
+
+    def get(self, path):
+        return self.submit(self.client.get, path)
+
+    def post(self, path, payload={}):
+        return self.submit(self.client.post, path, payload)
+
+    def put(self, path, payload={}):
+        return self.submit(self.client.put, path, payload)
+
+    def delete(self, path):
+        return self.submit(self.client.delete, path)
+
+    def patch(self, path, payload={}):
+        return self.submit(self.client.patch, path, payload)
+
+def gather(futures, timeout=None):
+    """Waits for all the `futures` and returns their results, in order."""
+    return [future.result(timeout) for future in futures]
@@ -1,7 +1,6 @@
-import base64
-import urllib2
-import urllib
 import json
+import threading
+import time
 
 class NullAuth(object):
     @property
@@ -21,30 +20,72 @@ class BasicAuth(object):
         return False
 
     def authenticate(self, request):
+        import base64
+        import urllib2
         user_pass = '{0}:{1}'.format(urllib2.quote(self.username), urllib2.quote(self.password))
         credentials = base64.b64encode(user_pass).strip()
         request.add_header('Authorization', 'Basic {0}'.format(credentials))
 
 class OAuth2Auth(object):
+    # Refresh the access token that many seconds before it expires
+    refresh_margin = 60
+
     def __init__(self, access_token=None, refresh_token=None, scope=None,
-                 client_id=None, client_secret=None, token_url=None):
+                 client_id=None, client_secret=None, token_url=None,
+                 expires_at=None, lock=None):
         self.access_token = access_token
         self.refresh_token = refresh_token
         self.scope = scope
         self.client_id = client_id
         self.client_secret = client_secret
         self.token_url = token_url
+        self.expires_at = expires_at
+        self.lock = lock
         self._retry_count = 0
+        self._refresh_lock = threading.Lock()
 
     @property
     def retriable(self):
         return self._retry_count < 1
 
+    @property
+    def expiring(self):
+        return self.expires_at is not None and \
+            time.time() > self.expires_at - self.refresh_margin
+
     def authenticate(self, request):
+        if self.expiring:
+            self.refresh(self.access_token)
         request.add_header('Authorization', 'Bearer {0}'.format(self.access_token))
 
     def prepare_retry(self):
         self._retry_count = self._retry_count + 1
+        return self.refresh(self.access_token)
+
+    def refresh(self, stale_token):
+        """Replaces `stale_token`. Threads sharing this authenticator wait
+        for a single refresh, and `lock` (a file lock shared by the CLI
+        processes) lets a process pick up the token another one just
+        refreshed instead of refreshing it again."""
+        with self._refresh_lock:
+            if self.access_token != stale_token:
+                return True
+            if self.lock is None:
+                return self._refresh(stale_token)
+            with self.lock:
+                return self._refresh(stale_token)
+
+    def _refresh(self, stale_token):
+        if hasattr(self, 'reload_callback'):
+            token = self.reload_callback()
+            if token and token.get('access_token') != stale_token:
+                self.access_token = token['access_token']
+                self.refresh_token = token['refresh_token']
+                self.expires_at = token_expiry(token)
+                if not self.expiring:
+                    return True
+        import urllib
+        import urllib2
         req = urllib2.Request(self.token_url)
         data = {
             'grant_type': 'refresh_token',
@@ -54,10 +95,20 @@ class OAuth2Auth(object):
             'scope': self.scope
         }
         req.add_data(urllib.urlencode(data))
+        issued_at = time.time()
         res = json.load(urllib2.urlopen(req))
         if res.get('access_token'):
+            res.setdefault('issued_at', issued_at)
             self.access_token = res['access_token']
             self.refresh_token = res['refresh_token']
+            self.expires_at = token_expiry(res)
             if hasattr(self, 'refresh_callback'):
                 return self.refresh_callback(res)
         return
+
+def token_expiry(token):
+    """Returns when an OAuth2 token (as returned by the token endpoint,
+    plus the `issued_at` timestamp) expires, or None if it doesn't say."""
+    if token.get('expires_in') is None or token.get('issued_at') is None:
+        return None
+    return token['issued_at'] + token['expires_in']
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+def related(a, b):
+    return a == b or a.startswith(b + '/') or b.startswith(a + '/')
+
+class CachedResponse(object):
+    """Stands in for the urllib2 response of a cached GET, so that
+    make_response and BaseResponse.create handle both the same way."""
+    def __init__(self, entry, headers=None):
+        self.code = entry['code']
+        self.headers = {
+            'Content-Type': entry['content_type'],
+            'Content-Length': str(len(entry['body'])),
+            'ETag': entry['etag']
+        }
+        if headers is not None:
+            self.headers['X-DotCloud-TraceID'] = headers.get('X-DotCloud-TraceID')
+        self.body = entry['body']
+        self.offset = 0
+
+    def info(self):
+        return self.headers
+
+    def read(self, amt=None):
+        if amt is None:
+            amt = len(self.body) - self.offset
+        data = self.body[self.offset:self.offset + amt]
+        self.offset += len(data)
+        return data
+
+class ResponseCache(object):
+    """On-disk cache of GET responses carrying an ETag.
+
+    Cached entries are revalidated with If-None-Match, evicted when they
+    get older than `max_age` seconds or when the cache grows over
+    `max_size` bytes, and invalidated by any write to a related URL."""
+
+    def __init__(self, directory, max_size=4 * 1024 * 1024, max_age=86400):
+        self.dir = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def key(self, url):
+        return hashlib.sha1(url).hexdigest()
+
+    def path_to(self, name):
+        return os.path.join(self.dir, name)
+
+    def load_index(self):
+        try:
+            return json.load(open(self.path_to('index')))
+        except (IOError, ValueError):
+            return {}
+
+    def write(self, name, data):
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir, 0700)
+        tmp = self.path_to('{0}.{1}.tmp'.format(name, os.getpid()))
+        f = open(tmp, 'w')
+        json.dump(data, f)
+        f.close()
+        os.rename(tmp, self.path_to(name))
+
+    def remove(self, index, key):
+        index.pop(key, None)
+        try:
+            os.unlink(self.path_to(key))
+        except OSError:
+            pass
+
+    def get(self, url):
+        key = self.key(url)
+        with self._lock:
+            index = self.load_index()
+            meta = index.get(key)
+            if meta is None:
+                return None
+            if time.time() - meta['stored_at'] > self.max_age:
+                self.remove(index, key)
+                self.write('index', index)
+                return None
+            try:
+                return json.load(open(self.path_to(key)))
+            except (IOError, ValueError):
+                return None
+
+    def store(self, url, res, body):
+        etag = res.headers.get('ETag')
+        if not etag:
+            return None
+        entry = {
+            'url': url,
+            'etag': etag,
+            'code': res.code,
+            'content_type': res.headers.get('Content-Type'),
+            'body': body,
+            'stored_at': time.time()
+        }
+        key = self.key(url)
+        with self._lock:
+            index = self.load_index()
+            self.write(key, entry)
+            index[key] = {'url': url, 'size': len(body), 'stored_at': entry['stored_at']}
+            self.evict(index)
+            self.write('index', index)
+        return entry
+
+    def evict(self, index):
+        now = time.time()
+        for key, meta in index.items():
+            if now - meta['stored_at'] > self.max_age:
+                self.remove(index, key)
+        total = sum(meta['size'] for meta in index.values())
+        for key, meta in sorted(index.items(), key=lambda i: i[1]['stored_at']):
+            if total <= self.max_size:
+                break
+            total -= meta['size']
+            self.remove(index, key)
+
+    def invalidate(self, url):
+        """Drops the entries for `url`, its sub-resources and the
+        collections it belongs to."""
+        url = url.split('?')[0].rstrip('/')
+        with self._lock:
+            index = self.load_index()
+            stale = [key for key, meta in index.items()
+                     if related(url, meta['url'].split('?')[0].rstrip('/'))]
+            if not stale:
+                return
+            for key in stale:
+                self.remove(index, key)
+            self.write('index', index)
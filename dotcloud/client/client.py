@@ -1,31 +1,111 @@
-import urllib2
-import httplib
-import socket
+import collections
 import json
+import random
 import sys
-import os
+import threading
+import time
 
 from .auth import BasicAuth, OAuth2Auth
+from .cache import CachedResponse
+from .compression import ENCODINGS, DecompressingReader, compress
 from .response import *
+from .stream import StreamDecoder
+from .timing import Timing
 from .errors import (RESTAPIError, AuthenticationNotConfigured,
-                     SSLVerificationError)
-from ..packages.ssl_match_hostname import match_hostname
-
-try:
-    import ssl
-except ImportError:
-    pass
+                     SSLVerificationError, DeadlineExceeded)
 
 class RESTClient(object):
-    def __init__(self, endpoint='https://rest.dotcloud.com/1', debug=False):
+    def __init__(self, endpoint='https://rest.dotcloud.com/1', debug=False,
+                 pool_size=4, idle_timeout=30, cache=None):
         self.endpoint = endpoint
         self.authenticator = None
+        self.cache = cache
+        self._local = threading.local()
         self.trace_id = None
         self.trace = None
+        self.timing_callbacks = []
         self.debug = debug
+        # Pages of lists bigger than that (or chunked) are decoded as
+        # they're read by iter_items() and stream(); get() reads them whole.
+        self.stream_threshold = 64 * 1024
+        # Request bodies bigger than that are gzipped, if set
+        self.compress_threshold = None
+        self.compression_stats = {'received': 0, 'received_decompressed': 0,
+                                  'sent': 0, 'sent_uncompressed': 0}
+        self._stats_lock = threading.Lock()
+        # Socket timeout of each request, and time.time() after which no
+        # request is sent anymore; None for no limit.
+        self.timeout = None
+        self.deadline = None
+        # GETs failing with a network error, a timeout or a 5xx are retried
+        # after `backoff`, 2 * `backoff`... seconds, with jitter.
+        self.retries = 2
+        self.backoff = 0.25
+        self.max_backoff = 4
+        # With `hedge`, a GET still running after `hedge` seconds (or the
+        # 95th percentile of the latencies if True) is sent a second time.
+        self.hedge = None
+        self.hedge_default = 1.0
+        # `timeout` and `deadline` only apply until the response headers
+        # of streamed bodies (e.g. build logs, which can stay silent for a
+        # while): their reads time out after `stream_timeout`, if set.
+        self.stream_timeout = None
+        self.latencies = collections.deque(maxlen=100)
+        # RequestMemo collapsing identical GETs, if set
+        self.memo = None
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._pool = None
+        self._opener = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            from .pool import ConnectionPool
+            self._pool = ConnectionPool(maxsize=self.pool_size,
+                                        idle_timeout=self.idle_timeout)
+        return self._pool
+
+    @property
+    def opener(self):
+        # Networking and SSL modules are only loaded by the first request,
+        # so that commands working offline start fast.
+        if self._opener is None:
+            import urllib2
+            from .pool import PooledHTTPHandler
+            from .transport import VerifiedHTTPSConnection
+            if 'ssl' in sys.modules:
+                handler = PooledHTTPHandler(self.pool, https_class=VerifiedHTTPSConnection)
+            else:
+                handler = PooledHTTPHandler(self.pool)
+            self._opener = urllib2.build_opener(handler)
+            urllib2.install_opener(self._opener)
+        return self._opener
+
+    @property
+    def tls_stats(self):
+        if self._opener is None:
+            return None
+        from .transport import stats
+        return stats
+
+    @property
+    def trace_id(self):
+        """Trace ID of the last response, sent with the next request. It's
+        kept per thread, so that concurrent requests don't mix them up."""
+        return getattr(self._local, 'trace_id', None)
 
-        if 'ssl' in sys.modules:
-            urllib2.install_opener(urllib2.build_opener(VerifiedHTTPSHandler()))
+    @trace_id.setter
+    def trace_id(self, value):
+        self._local.trace_id = value
+
+    def add_timing_callback(self, func):
+        """Calls `func` with a Timing once each request is complete. With
+        AsyncRESTClient or iter_items(), it's called from other threads."""
+        self.timing_callbacks.append(func)
+
+    def remove_timing_callback(self, func):
+        self.timing_callbacks.remove(func)
 
     def build_url(self, path):
         if path.startswith('/'):
@@ -33,75 +113,349 @@ class RESTClient(object):
         else:
             return path
 
-    def get(self, path):
+    def make_request(self, method, path, payload=None, headers={}):
+        import urllib2
         url = self.build_url(path)
-        req = urllib2.Request(url)
+        headers = dict(headers)
+        data = None
+        if payload is not None:
+            data = json.dumps(payload)
+            headers['Content-Type'] = 'application/json'
+            if self.compress_threshold is not None and len(data) > self.compress_threshold:
+                size = len(data)
+                data = compress(data)
+                headers['Content-Encoding'] = 'gzip'
+                with self._stats_lock:
+                    self.compression_stats['sent'] += len(data)
+                    self.compression_stats['sent_uncompressed'] += size
+        req = urllib2.Request(url, data, headers)
+        if method not in ('GET', 'POST'):
+            req.get_method = lambda: method
+        return req
+
+    def get(self, path, memo=True):
+        """GET `path`. With `memo` False, the request is sent even if the
+        response is known already, e.g. to poll for changes."""
+        return self.memoized(path, memo, lambda: self.request(self.make_request('GET', path)))
+
+    def memoized(self, path, memo, func):
+        if not memo or self.memo is None:
+            return func()
+        return self.memo.get(self.build_url(path), func)
+
+    def get_page(self, path):
+        """GET a page of a list, which may come back as a
+        StreamingListResponse: its items can only be iterated once."""
+        req = self.make_request('GET', path)
+        req.stream_lists = True
+        return self.memoized(path, True, lambda: self.request(req))
+
+    def stream(self, path):
+        """GET `path`, asking the server to stream the objects as newline
+        delimited JSON. Servers that don't support it answer with a
+        regular (paginated) response, so both have to be handled."""
+        req = self.make_request('GET', path, headers={
+            'Accept': 'application/x-ndjson, application/json'
+        })
+        req.stream_lists = True
         return self.request(req)
 
+    def iter_items(self, path, prefetch=True):
+        """Yields the items of the list at `path` across all its pages.
+
+        Pages are requested as the items are consumed, following the `next`
+        links; with `prefetch`, the following page is fetched in the
+        background while the current one is processed."""
+        res = self.get_page(path)
+        while res is not None:
+            # Links of a streamed page are only known once it's read
+            streaming = isinstance(res, StreamingListResponse)
+            next = None if streaming else res.find_link('next')
+            fetch = None
+            if next and prefetch:
+                fetch = Prefetch(self.get_page, next.get('href'))
+            for item in res.items or []:
+                yield item
+            if streaming:
+                next = res.find_link('next')
+            if not next:
+                break
+            res = fetch.result() if fetch else self.get_page(next.get('href'))
+
     def post(self, path, payload={}):
-        url = self.build_url(path)
-        data = json.dumps(payload)
-        req = urllib2.Request(url, data, {'Content-Type': 'application/json'})
-        return self.request(req)
+        return self.request(self.make_request('POST', path, payload))
 
     def put(self, path, payload={}):
-        url = self.build_url(path)
-        data = json.dumps(payload)
-        req = urllib2.Request(url, data, {'Content-Type': 'application/json'})
-        req.get_method = lambda: 'PUT'
-        return self.request(req)
+        return self.request(self.make_request('PUT', path, payload))
 
     def delete(self, path):
-        url = self.build_url(path)
-        req = urllib2.Request(url)
-        req.get_method = lambda: 'DELETE'
-        return self.request(req)
+        return self.request(self.make_request('DELETE', path))
 
     def patch(self, path, payload={}):
-        url = self.build_url(path)
-        data = json.dumps(payload)
-        req = urllib2.Request(url, data, {'Content-Type': 'application/json'})
-        req.get_method = lambda: 'PATCH'
-        return self.request(req)
+        return self.request(self.make_request('PATCH', path, payload))
+
+    def set_deadline(self, seconds):
+        self.deadline = time.time() + seconds
+
+    def request_timeout(self):
+        """Returns the timeout of the next request, shortened to what's
+        left before the deadline."""
+        timeout = self.timeout
+        if self.deadline is not None:
+            left = self.deadline - time.time()
+            if left <= 0:
+                raise DeadlineExceeded('Deadline exceeded')
+            timeout = left if timeout is None else min(timeout, left)
+        return timeout
+
+    def retriable(self, e):
+        import socket
+        import urllib2
+        if isinstance(e, RESTAPIError):
+            return e.code >= 500
+        return isinstance(e, (urllib2.URLError, socket.error))
 
     def request(self, req):
+        import socket
+        import urllib2
+        if req.get_method() != 'GET' and self.memo is not None:
+            # GETs sent before or during a write may be outdated
+            self.memo.clear()
+            try:
+                return self.attempt(req)
+            finally:
+                self.memo.clear()
+        attempt = 0
+        while True:
+            try:
+                if req.get_method() != 'GET':
+                    return self.attempt(req)
+                if self.hedge:
+                    return self.hedged(req)
+                return self.attempt(req)
+            except (RESTAPIError, IOError), e:
+                if self.deadline is not None and time.time() >= self.deadline \
+                        and isinstance(e, IOError):
+                    raise DeadlineExceeded('Deadline exceeded: {0}'.format(e))
+                if req.get_method() != 'GET' or attempt >= self.retries \
+                        or not self.retriable(e):
+                    if isinstance(e, socket.error):
+                        raise urllib2.URLError(e)
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if self.deadline is not None and time.time() + delay >= self.deadline:
+                    raise DeadlineExceeded('Deadline exceeded: {0}'.format(e))
+                if self.debug:
+                    print >>sys.stderr, '### {0}, retrying in {1:.2f}s'.format(e, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def hedge_delay(self):
+        if self.hedge is not True:
+            return self.hedge
+        latencies = sorted(self.latencies)
+        if len(latencies) < 10:
+            return self.hedge_default
+        return latencies[int(len(latencies) * 0.95) - 1]
+
+    def hedged(self, req):
+        """Sends the GET `req`, and a copy of it if there's no response
+        after the hedging delay. Returns the first successful response;
+        the other one is dropped when it comes."""
+        import Queue
+        import urllib2
+        results = Queue.Queue()
+        lock = threading.Lock()
+        state = {'done': False}
+        trace_id = self.trace_id
+        # Taken before send() adds its headers (Accept, If-None-Match...),
+        # so that the copy goes through the cache the same way
+        headers = dict(req.headers)
+
+        def run(r):
+            self.trace_id = trace_id
+            try:
+                res, exc_info = self.attempt(r), None
+            except:
+                res, exc_info = None, sys.exc_info()
+            with lock:
+                if not state['done']:
+                    results.put((res, exc_info, self.trace_id))
+                    return
+            close_response(res)
+
+        def start(r):
+            thread = threading.Thread(target=run, args=(r,))
+            thread.daemon = True
+            thread.start()
+
+        start(req)
+        pending = 1
+        try:
+            res, exc_info, trace_id = results.get(timeout=self.hedge_delay())
+            pending -= 1
+        except Queue.Empty:
+            if self.debug:
+                print >>sys.stderr, '### hedging {0}'.format(req.get_full_url())
+            copy = urllib2.Request(req.get_full_url(), None, headers)
+            copy.stream_lists = getattr(req, 'stream_lists', False)
+            start(copy)
+            pending += 1
+            # A timeout keeps the wait interruptible with ^C
+            res, exc_info, trace_id = results.get(timeout=86400)
+            pending -= 1
+            if exc_info and pending:
+                res, exc_info, trace_id = results.get(timeout=86400)
+                pending -= 1
+        with lock:
+            state['done'] = True
+        while not results.empty():
+            close_response(results.get()[0])
+        self.trace_id = trace_id
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return res
+
+    def attempt(self, req):
+        start = time.time()
+        if not self.timing_callbacks:
+            res = self.send(req)
+        else:
+            res = self.timed_send(req)
+        if req.get_method() == 'GET':
+            self.latencies.append(time.time() - start)
+        return res
+
+    def timed_send(self, req):
+        timing = req.timing = Timing(req.get_method(), req.get_full_url(),
+                                     list(self.timing_callbacks))
+        streaming = False
+        try:
+            res = self.send(req, timing)
+            # The body of streamed responses is still to be read
+            streaming = is_streaming(res)
+            return res
+        finally:
+            timing.response_made(streaming)
+
+    def send(self, req, timing=None):
+        import socket
+        import urllib2
+        timeout = self.request_timeout()
         if not self.authenticator:
             raise AuthenticationNotConfigured
         self.authenticator.authenticate(req)
-        req.add_header('Accept', 'application/json')
+        method = req.get_method()
+        cacheable = self.cache and method == 'GET' and not req.has_header('Accept')
+        cached = None
+        if cacheable:
+            cached = self.cache.get(req.get_full_url())
+            if cached:
+                req.add_header('If-None-Match', cached['etag'])
+        elif self.cache and method != 'GET':
+            self.cache.invalidate(req.get_full_url())
+        if not req.has_header('Accept'):
+            req.add_header('Accept', 'application/json')
+        req.add_header('Accept-Encoding', 'gzip, deflate')
         if self.trace_id:
             req.add_header('X-DotCloud-TraceID', self.trace_id)
         if self.debug:
             print >>sys.stderr, '### {method} {url} data=|{data}|'.format(
                 method  = req.get_method(),
                 url     = req.get_full_url(),
-                data    = req.get_data()
+                data    = '<gzip>' if req.has_header('Content-encoding') else req.get_data()
             )
 
             
         try:
-            res = urllib2.urlopen(req)
+            if timeout is None:
+                timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+            res = self.decompress(self.opener.open(req, timeout=timeout), timing)
             if res and self.debug:
                 print >>sys.stderr, '### {code}'.format(code=res.code)
             self.trace_id = res.headers.get('X-DotCloud-TraceID')
             if self.trace:
                 self.trace(self.trace_id)
-            return self.make_response(res)
+            if timing:
+                timing.status = res.code
+                timing.trace_id = self.trace_id
+            if cacheable and res.code == 200 and res.headers.get('ETag'):
+                entry = self.cache.store(req.get_full_url(), res, res.read())
+                return self.make_response(CachedResponse(entry, res.headers), timing, req)
+            response = self.make_response(res, timing, req)
+            if is_streaming(response) and hasattr(res.fp, 'settimeout'):
+                res.fp.settimeout(socket._GLOBAL_DEFAULT_TIMEOUT if self.stream_timeout is None
+                                  else self.stream_timeout)
+            return response
         except urllib2.HTTPError, e:
+            if timing:
+                timing.status = e.code
+                timing.trace_id = e.headers.get('X-DotCloud-TraceID')
+            if e.code == 304 and cached:
+                if self.debug:
+                    print >>sys.stderr, '### served from cache'
+                self.trace_id = e.headers.get('X-DotCloud-TraceID')
+                if self.trace:
+                    self.trace(self.trace_id)
+                if timing:
+                    timing.cached = True
+                return self.make_response(CachedResponse(cached, e.headers), timing, req)
             if e.code == 401 and self.authenticator.retriable:
                 if self.authenticator.prepare_retry():
+                    # Hands the connection back (or drops it) before retrying
+                    e.close()
+                    if timing:
+                        timing.response_made()
                     return self.request(req)
-            return self.make_response(e)
+            return self.make_response(self.decompress(e, timing), timing)
         except urllib2.URLError, e:
-            if 'ssl' in sys.modules and isinstance(e.reason, ssl.SSLError):
+            if 'ssl' in sys.modules and isinstance(e.reason, sys.modules['ssl'].SSLError):
                 if self.debug:
                     print >> sys.stderr, '### %s' % e.reason.strerror
                 raise SSLVerificationError(str(e.reason))
             raise
 
-    def make_response(self, res):
+    def decompress(self, res, timing=None):
+        """Returns `res` decompressing its body as it's read, if the server
+        compressed it."""
+        encoding = (res.headers.get('Content-Encoding') or '').lower()
+        if encoding not in ENCODINGS:
+            return res
+        import urllib2
+        def progress(compressed, decompressed):
+            with self._stats_lock:
+                self.compression_stats['received'] += compressed
+                self.compression_stats['received_decompressed'] += decompressed
+            if timing:
+                timing.bytes_saved += decompressed - compressed
+        fp = DecompressingReader(res.fp, encoding, progress)
+        wrapped = urllib2.addinfourl(fp, res.headers, res.geturl())
+        wrapped.code = res.code
+        wrapped.msg = res.msg
+        return wrapped
+
+    def streamable(self, req, res):
+        if not getattr(req, 'stream_lists', False):
+            return False
+        if self.stream_threshold is None or res.code >= 400:
+            return False
+        length = res.headers.get('Content-Length')
+        return length is None or int(length) > self.stream_threshold
+
+    def make_response(self, res, timing=None, req=None):
+        if res.headers['Content-Type'] == 'application/x-ndjson' and res.code < 400:
+            return StreamResponse(res, timing)
         if res.headers['Content-Type'] == 'application/json':
-            data = json.loads(res.read())
+            if self.streamable(req, res):
+                decoder = StreamDecoder(lambda: read_chunk(res), timing=timing)
+                if decoder.start():
+                    return StreamingListResponse(res, decoder)
+                return BaseResponse.create(res=res, data=decoder.rest)
+            body = res.read()
+            start = time.time()
+            data = json.loads(body)
+            if timing:
+                timing.add('decode', time.time() - start)
         elif res.code == 204:
             return None
         else:
@@ -111,34 +465,37 @@ class RESTClient(object):
             raise RESTAPIError(code=res.code, desc=data['error']['description'])
         return BaseResponse.create(res=res, data=data)
 
-class VerifiedHTTPSConnection(httplib.HTTPSConnection):
-    def __init__(self, *args, **kwargs):
-        self.ca_certs = get_data_file_path('ca_certs.pem')
-        httplib.HTTPSConnection.__init__(self, *args, **kwargs)
-
-    def connect(self):
-        sock = socket.create_connection((self.host, self.port),
-                                        self.timeout)
-        if self._tunnel_host:
-            self.sock = sock
-            self._tunnel()
-
-        self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file,
-                                    cert_reqs=ssl.CERT_REQUIRED,
-                                    ca_certs=self.ca_certs)
-
-        if self.ca_certs:
-            match_hostname(self.sock.getpeercert(), self.host)
-
-class VerifiedHTTPSHandler(urllib2.HTTPSHandler):
-    def __init__(self, verified_http_class=VerifiedHTTPSConnection):
-        self.verified_http_class = verified_http_class
-        urllib2.HTTPSHandler.__init__(self)
-
-    def https_open(self, req):
-        return self.do_open(self.verified_http_class, req)
-
-def get_data_file_path(file_path):
-    path = os.path.join('data', *(file_path.split('/')))
-    d = os.path.dirname(sys.modules[__package__].__file__)
-    return os.path.join(d, path)
+def is_streaming(res):
+    """Tells if the body of `res` is still to be read."""
+    return isinstance(res, (StreamingListResponse, StreamResponse))
+
+def close_response(res):
+    """Drops the connection of a response whose body is still to be read."""
+    if is_streaming(res):
+        res.res.close()
+
+class Prefetch(object):
+    """Runs `func(*args)` in a background thread; result() waits for it
+    and returns its value or raises its exception."""
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+        self.value = None
+        self.exc_info = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args)
+        except:
+            self.exc_info = sys.exc_info()
+
+    def result(self):
+        while self.thread.is_alive():
+            # A timeout keeps the wait interruptible with ^C
+            self.thread.join(86400)
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
@@ -0,0 +1,81 @@
+import zlib
+
+ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+def compress(data):
+    """Returns `data` gzip-compressed."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+class DecompressingReader(object):
+    """File-like object decompressing a gzip or deflate body as it's read
+    from `fp`. `progress(compressed, decompressed)` is called with the
+    size of each chunk before and after decompression."""
+
+    def __init__(self, fp, encoding, progress=None):
+        self.fp = fp
+        self.encoding = encoding
+        if encoding == 'deflate':
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.progress = progress
+        self.buf = ''
+        self.eof = False
+        self.compressed = 0
+
+    def raw_chunk(self, size):
+        if hasattr(self.fp, 'read_chunk'):
+            return self.fp.read_chunk(size)
+        return self.fp.read(size)
+
+    def fill(self, size=16384):
+        data = self.raw_chunk(size)
+        if not data:
+            out = self.decompressor.flush()
+            self.eof = True
+            if self.progress and out:
+                self.progress(0, len(out))
+            self.buf += out
+            return
+        if not self.compressed and self.encoding == 'deflate':
+            try:
+                self.decompressor.copy().decompress(data)
+            except zlib.error:
+                # Some servers send raw deflate streams, without zlib header
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.compressed += len(data)
+        out = self.decompressor.decompress(data)
+        if self.progress:
+            self.progress(len(data), len(out))
+        self.buf += out
+
+    def read_chunk(self, size=16384):
+        """Returns what could be decompressed from the next chunk of the
+        body, or '' at its end."""
+        while not self.buf and not self.eof:
+            self.fill(size)
+        data, self.buf = self.buf, ''
+        return data
+
+    def read(self, amt=None):
+        while not self.eof and (amt is None or len(self.buf) < amt):
+            self.fill()
+        if amt is None:
+            data, self.buf = self.buf, ''
+        else:
+            data, self.buf = self.buf[:amt], self.buf[amt:]
+        return data
+
+    def readline(self):
+        while '\n' not in self.buf and not self.eof:
+            self.fill()
+        line, sep, self.buf = self.buf.partition('\n')
+        return line + sep
+
+    def settimeout(self, timeout):
+        if hasattr(self.fp, 'settimeout'):
+            self.fp.settimeout(timeout)
+
+    def close(self):
+        self.fp.close()
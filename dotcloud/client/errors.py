@@ -10,3 +10,5 @@ class AuthenticationNotConfigured(Exception):
     pass
 class SSLVerificationError(Exception):
     pass
+class DeadlineExceeded(Exception):
+    pass
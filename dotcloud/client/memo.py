@@ -0,0 +1,83 @@
+import sys
+import threading
+
+from .response import StreamingListResponse, StreamResponse
+
+class Call(object):
+    """A GET in flight, whose result is shared with identical GETs."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.res = None
+        self.exc_info = None
+
+    def result(self):
+        while not self.event.is_set():
+            # A timeout keeps the wait interruptible with ^C
+            self.event.wait(86400)
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.res
+
+class RequestMemo(object):
+    """Collapses identical GETs into one request: concurrent ones wait
+    for the one in flight ("singleflight") and, with `remember`, later
+    ones get the same response until clear() is called, i.e. until the
+    next write.
+
+    Responses whose body is still to be read can only be consumed once:
+    they're neither shared nor remembered. `saved` counts the requests
+    that didn't have to be sent."""
+
+    def __init__(self, remember=True):
+        self.remember = remember
+        self.saved = 0
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.responses = {}
+        self.generation = 0
+
+    def shareable(self, res):
+        return not isinstance(res, (StreamingListResponse, StreamResponse))
+
+    def get(self, key, func):
+        """Returns the response for `key`, calling `func` to get it unless
+        it's known or already being fetched."""
+        with self.lock:
+            if key in self.responses:
+                self.saved += 1
+                return self.responses[key]
+            call = self.inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self.inflight[key] = Call()
+                generation = self.generation
+        if not leader:
+            # Errors are shared too: the request was retried already
+            res = call.result()
+            if not self.shareable(res):
+                return func()
+            with self.lock:
+                self.saved += 1
+            return res
+        try:
+            call.res = func()
+        except:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                if self.inflight.get(key) is call:
+                    del self.inflight[key]
+                if self.remember and not call.exc_info and generation == self.generation \
+                        and self.shareable(call.res):
+                    self.responses[key] = call.res
+            call.event.set()
+        return call.res
+
+    def clear(self):
+        """Forgets the responses, and doesn't let the GETs in flight be
+        remembered or joined: they may have been sent before a write."""
+        with self.lock:
+            self.generation += 1
+            self.responses.clear()
+            self.inflight.clear()
@@ -0,0 +1,230 @@
+import httplib
+import socket
+import threading
+import time
+import urllib2
+
+from .timing import create_connection
+
+class ConnectionPool(object):
+    """Keeps idle HTTP/1.1 connections around, keyed by (scheme, host,
+    tunnelled host), so that following requests to the same host skip the
+    TCP connect and the TLS handshake."""
+
+    def __init__(self, maxsize=4, idle_timeout=30):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(key, [])
+            now = time.time()
+            while idle:
+                candidate, released_at = idle.pop()
+                if now - released_at < self.idle_timeout:
+                    conn = candidate
+                    self.stats['reused'] += 1
+                    break
+                stale.append(candidate)
+                self.stats['discarded'] += 1
+            if conn is None:
+                self.stats['created'] += 1
+        for c in stale:
+            c.close()
+        if conn is not None:
+            return conn, True
+        return factory(), False
+
+    def release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+            self.stats['discarded'] += 1
+        conn.close()
+
+    def discard(self, conn, reused=False):
+        with self._lock:
+            self.stats['discarded'] += 1
+            if reused:
+                self.stats['reused'] -= 1
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+class PooledResponse(object):
+    """File-like wrapper around httplib.HTTPResponse that hands the
+    connection back to the pool once the body has been fully read."""
+
+    def __init__(self, response, release, discard, timing=None, conn=None):
+        self.response = response
+        self.conn = conn
+        self._release = release
+        self._discard = discard
+        self._done = False
+        self.timing = timing
+        self._check()
+
+    def _check(self):
+        if not self._done and self.response.isclosed():
+            self._done = True
+            if self.response.will_close:
+                self._discard()
+            else:
+                self._release()
+            if self.timing:
+                self.timing.body_done()
+
+    def read(self, amt=None):
+        if self.timing:
+            start = time.time()
+            data = self.response.read(amt)
+            self.timing.add('body', time.time() - start)
+        else:
+            data = self.response.read(amt)
+        self._check()
+        return data
+
+    def read_chunk(self, size=16384):
+        """Reads whatever is available of the body, up to the end of the
+        current HTTP chunk for chunked responses, so that streamed bodies
+        can be consumed as the server flushes them."""
+        if not self.response.chunked:
+            return self.read(size)
+        data = self.read(1)
+        left = self.response.chunk_left
+        if data and left:
+            data += self.read(left)
+        return data
+
+    def readline(self):
+        line = []
+        while True:
+            c = self.read(1)
+            line.append(c)
+            if not c or c == '\n':
+                break
+        return ''.join(line)
+
+    def settimeout(self, timeout):
+        """Changes the timeout of the reads of the rest of the body."""
+        if self.conn is not None:
+            set_timeout(self.conn, timeout)
+
+    def close(self):
+        if not self._done:
+            # Unread body left on the wire, the connection can't be reused
+            self._done = True
+            self.response.close()
+            self._discard()
+            if self.timing:
+                self.timing.body_done()
+
+def set_timeout(conn, timeout):
+    """Applies the timeout of a new request to a reused connection."""
+    conn.timeout = timeout
+    if conn.sock is not None:
+        if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = socket.getdefaulttimeout()
+        conn.sock.settimeout(timeout)
+
+class HTTPConnection(httplib.HTTPConnection):
+    """HTTPConnection recording its DNS and connect times in `timing`."""
+    timing = None
+
+    def connect(self):
+        self.sock = create_connection((self.host, self.port), self.timeout,
+                                      self.timing)
+        if self._tunnel_host:
+            self._tunnel()
+
+class PooledHTTPHandler(urllib2.HTTPHandler,
+                        getattr(urllib2, 'HTTPSHandler', object)):
+    def __init__(self, pool=None, https_class=None):
+        urllib2.HTTPHandler.__init__(self)
+        self.pool = pool or ConnectionPool()
+        self.https_class = https_class or getattr(httplib, 'HTTPSConnection', None)
+
+    def http_open(self, req):
+        return self.pooled_open(HTTPConnection, req)
+
+    def https_open(self, req):
+        return self.pooled_open(self.https_class, req)
+
+    def pooled_open(self, http_class, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        # Through an HTTPS proxy, `host` is the proxy and connections are
+        # tunnelled to req._tunnel_host with CONNECT.
+        tunnel_host = req._tunnel_host
+        key = (req.get_type(), host, tunnel_host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+        tunnel_headers = {}
+        if tunnel_host and 'Proxy-Authorization' in headers:
+            # Meant for the proxy, not to be sent through the tunnel
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+        def connection():
+            conn = http_class(host, timeout=req.timeout)
+            if tunnel_host:
+                conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+            return conn
+
+        timing = getattr(req, 'timing', None)
+        # Once sent, a request may have been handled even if the response
+        # is lost: only the ones that can be repeated are sent again
+        idempotent = req.get_method() in ('GET', 'HEAD')
+        while True:
+            conn, reused = self.pool.acquire(key, connection)
+            written = False
+            if reused:
+                set_timeout(conn, req.timeout)
+            try:
+                conn.timing = timing
+                if timing:
+                    timing.reused = reused
+                    if conn.sock is None:
+                        conn.connect()
+                    sent = time.time()
+                conn.request(req.get_method(), req.get_selector(), req.data, headers)
+                written = True
+                r = conn.getresponse(buffering=True)
+                if timing:
+                    timing.add('ttfb', time.time() - sent)
+            except (socket.error, httplib.HTTPException), e:
+                self.pool.discard(conn, reused)
+                if reused and not isinstance(e, socket.timeout) \
+                        and (idempotent or not written):
+                    # The server dropped the idle keep-alive connection
+                    continue
+                raise urllib2.URLError(e)
+            break
+
+        if r.length == 0:
+            # Nothing to read (204, 304...), close the response right away
+            r.read()
+
+        fp = PooledResponse(r,
+                            release=lambda: self.pool.release(key, conn),
+                            discard=lambda: self.pool.discard(conn), timing=timing,
+                            conn=conn)
+        resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
@@ -1,3 +1,6 @@
+import json
+import time
+
 class BaseResponse(object):
     def __init__(self, obj=None):
         self.obj = obj
@@ -30,6 +33,40 @@ class ListResponse(BaseResponse):
     def item(self):
         return self.obj[0]
         
+class StreamingListResponse(ListResponse):
+    """List response decoded while it is read: `items` yields the objects
+    as they arrive, without keeping them around, so it can be iterated
+    once. `obj`, `data` and find_link() read the rest of the body."""
+    def __init__(self, res, decoder):
+        self.res = res
+        self.decoder = decoder
+        self.decoded = []
+
+    @property
+    def items(self):
+        while self.decoded:
+            yield self.decoded.pop(0)
+        for item in self.decoder:
+            yield item
+
+    @property
+    def obj(self):
+        self.decoded.extend(self.decoder)
+        return self.decoded
+
+    @property
+    def item(self):
+        return self.obj[0]
+
+    @property
+    def data(self):
+        # Members after `objects`, like `links`, are only known once the
+        # objects are read
+        objects = self.obj
+        data = dict(self.decoder.rest)
+        data['objects'] = objects
+        return data
+
 class ItemResponse(BaseResponse):
     @property
     def items(self):
@@ -47,3 +84,60 @@ class NoItemResponse(BaseResponse):
     @property
     def item(self):
         return None
+
+def read_chunk(res, size=16384):
+    """Reads what's available of a response body, without waiting for
+    `size` bytes when the server sends it in chunks. Network errors are
+    raised as URLError, as they are while sending the request."""
+    import socket
+    fp = getattr(res, 'fp', None)
+    try:
+        if hasattr(fp, 'read_chunk'):
+            return fp.read_chunk()
+        return res.read(size)
+    except socket.error, e:
+        import urllib2
+        raise urllib2.URLError(e)
+
+class StreamResponse(BaseResponse):
+    """Response to a streamed request: the body is newline delimited JSON
+    and items are decoded one by one as the server sends them."""
+    def __init__(self, res, timing=None):
+        self.obj = None
+        self.res = res
+        self.data = {}
+        self.timing = timing
+
+    def decode(self, line):
+        start = time.time()
+        obj = json.loads(line)
+        if self.timing:
+            self.timing.add('decode', time.time() - start)
+        return obj
+
+    @property
+    def batches(self):
+        """Yields lists of the items decoded from each chunk received."""
+        buf = ''
+        while True:
+            data = read_chunk(self.res, 1)
+            if not data:
+                break
+            buf += data
+            lines = buf.split('\n')
+            buf = lines.pop()
+            batch = [self.decode(line) for line in lines if line.strip()]
+            if batch:
+                yield batch
+        if buf.strip():
+            yield [self.decode(buf)]
+
+    @property
+    def items(self):
+        for batch in self.batches:
+            for item in batch:
+                yield item
+
+    @property
+    def item(self):
+        return None
@@ -0,0 +1,123 @@
+import json
+import time
+
+WHITESPACE = ' \t\r\n'
+
+class StreamDecoder(object):
+    """Incremental decoder for a JSON object holding a big array under
+    `key`, read through `read()` (which returns '' at the end of the body).
+
+    start() decodes the members preceding the array, then the array
+    elements are decoded one at a time while iterating over the decoder.
+    All the other members end up in `rest`. Time spent decoding is added
+    to the `timing` of the request, if any."""
+
+    def __init__(self, read, key='objects', timing=None):
+        self.read = read
+        self.key = key
+        self.timing = timing
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.rest = {}
+        self.decoder = json.JSONDecoder()
+        self.in_array = False
+        self.done = False
+
+    def fill(self):
+        data = self.read()
+        if not data:
+            self.eof = True
+        else:
+            self.buf = self.buf[self.pos:] + data
+            self.pos = 0
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                raise ValueError('Unexpected end of JSON body')
+            self.fill()
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise ValueError('Expected one of {0!r} in JSON body, got {1!r}'.format(chars, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                start = time.time()
+                try:
+                    obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                finally:
+                    if self.timing:
+                        self.timing.add('decode', time.time() - start)
+                # A number at the end of the buffer might not be complete
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def members(self):
+        """Decodes members until the array starts or the object ends."""
+        while True:
+            if self.peek() == '}':
+                self.pos += 1
+                self.finish()
+                return
+            key = self.value()
+            self.expect(':')
+            if key == self.key and self.peek() == '[':
+                self.pos += 1
+                self.in_array = True
+                return
+            self.rest[key] = self.value()
+            if self.expect(',}') == '}':
+                self.finish()
+                return
+
+    def start(self):
+        """Returns True if the body has the array, and its items are next."""
+        self.expect('{')
+        self.members()
+        return self.in_array
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self.in_array:
+            raise StopIteration
+        if self.peek() == ']':
+            self.pos += 1
+        else:
+            item = self.value()
+            if self.expect(',]') == ',':
+                return item
+            self.end_array()
+            return item
+        self.end_array()
+        raise StopIteration
+
+    def end_array(self):
+        self.in_array = False
+        if self.expect(',}') == ',':
+            self.members()
+        else:
+            self.finish()
+
+    def finish(self):
+        # Reading up to the end lets the connection go back to the pool
+        self.done = True
+        while not self.eof:
+            self.fill()
@@ -0,0 +1,95 @@
+import socket
+import threading
+import time
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'body', 'decode')
+
+class Timing(object):
+    """Latency breakdown of one API request, in seconds.
+
+    `phases` only has the phases that happened: a request made on a
+    reused connection has no dns, connect or tls. Once the body has been
+    read and decoded, finish() hands the timing to the `callbacks`."""
+
+    def __init__(self, method, url, callbacks=()):
+        self.method = method
+        self.url = url
+        self.callbacks = callbacks
+        self.trace_id = None
+        self.status = None
+        self.reused = False
+        self.cached = False
+        # Response bytes that didn't go over the wire thanks to compression
+        self.bytes_saved = 0
+        self.start = time.time()
+        self.end = None
+        self.phases = {}
+        self._lock = threading.Lock()
+        self._body_done = False
+        self._streaming = None
+        self._finished = False
+
+    def add(self, phase, duration):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    @property
+    def total(self):
+        return (self.end or time.time()) - self.start
+
+    def body_done(self):
+        """Called once the whole body has been read (or dropped)."""
+        with self._lock:
+            self._body_done = True
+            ready = self._streaming is not None
+        if ready:
+            self.finish()
+
+    def response_made(self, streaming=False):
+        """Called once the response object is returned to the caller; the
+        body of streamed responses is still to be read."""
+        with self._lock:
+            self._streaming = streaming
+            ready = self._body_done or not streaming
+        if ready:
+            self.finish()
+
+    def finish(self):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self.end = time.time()
+        for callback in self.callbacks:
+            callback(self)
+
+def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, timing=None):
+    """socket.create_connection(), recording the name resolution and the
+    TCP connect as separate phases of `timing`."""
+    if timing is None:
+        return socket.create_connection(address, timeout)
+    host, port = address
+    start = time.time()
+    addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    timing.add('dns', time.time() - start)
+    start = time.time()
+    error = socket.error('getaddrinfo returns an empty list')
+    for family, socktype, proto, canonname, sockaddr in addresses:
+        try:
+            # A numeric address doesn't go through the resolver again
+            sock = socket.create_connection(sockaddr[:2], timeout)
+            break
+        except socket.error, e:
+            error = e
+    else:
+        raise error
+    timing.add('connect', time.time() - start)
+    return sock
+
+def summarize(timings):
+    """Returns the total time spent in each phase by `timings`."""
+    totals = dict((phase, 0.0) for phase in PHASES)
+    for timing in timings:
+        for phase, duration in timing.phases.iteritems():
+            totals[phase] += duration
+    return totals
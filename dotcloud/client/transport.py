@@ -0,0 +1,96 @@
+import hashlib
+import httplib
+import threading
+import time
+import urllib2
+import sys
+import os
+
+from ..packages.ssl_match_hostname import match_hostname
+from .timing import create_connection
+
+try:
+    import ssl
+except ImportError:
+    pass
+
+class VerifiedHTTPSConnection(httplib.HTTPSConnection):
+    timing = None
+
+    def __init__(self, *args, **kwargs):
+        self.ca_certs = get_data_file_path('ca_certs.pem')
+        httplib.HTTPSConnection.__init__(self, *args, **kwargs)
+
+    def connect(self):
+        sock = create_connection((self.host, self.port), self.timeout,
+                                 self.timing)
+        if self._tunnel_host:
+            self.sock = sock
+            self._tunnel()
+
+        # Through a proxy, the certificate is the one of the tunnelled host
+        host = self._tunnel_host or self.host
+        start = time.time()
+        context = get_ssl_context(self.ca_certs)
+        if context is not None and not (self.key_file or self.cert_file):
+            kwargs = {}
+            if getattr(ssl, 'HAS_SNI', False):
+                kwargs['server_hostname'] = host
+            self.sock = context.wrap_socket(sock, **kwargs)
+        else:
+            self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file,
+                                        cert_reqs=ssl.CERT_REQUIRED,
+                                        ca_certs=self.ca_certs)
+        record_handshake(time.time() - start)
+        if self.timing:
+            self.timing.add('tls', time.time() - start)
+
+        if self.ca_certs:
+            verify_hostname(self.sock, host)
+
+class VerifiedHTTPSHandler(urllib2.HTTPSHandler):
+    def __init__(self, verified_http_class=VerifiedHTTPSConnection):
+        self.verified_http_class = verified_http_class
+        urllib2.HTTPSHandler.__init__(self)
+
+    def https_open(self, req):
+        return self.do_open(self.verified_http_class, req)
+
+def get_data_file_path(file_path):
+    path = os.path.join('data', *(file_path.split('/')))
+    d = os.path.dirname(sys.modules[__package__].__file__)
+    return os.path.join(d, path)
+
+# TLS state shared by every connection of the process: the SSL context
+# (so the CA bundle is parsed once) and the certificates already checked
+# against a hostname. Python 2's ssl module can't resume sessions: what
+# saves handshakes is the connection pool keeping connections open.
+_lock = threading.Lock()
+_context = None
+_verified = set()
+stats = {'handshakes': 0, 'handshake_time': 0.0}
+
+def get_ssl_context(ca_certs):
+    global _context
+    if not hasattr(ssl, 'SSLContext'):
+        return None
+    with _lock:
+        if _context is None:
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.verify_mode = ssl.CERT_REQUIRED
+            context.load_verify_locations(ca_certs)
+            _context = context
+    return _context
+
+def record_handshake(duration):
+    with _lock:
+        stats['handshakes'] += 1
+        stats['handshake_time'] += duration
+
+def verify_hostname(sock, host):
+    fingerprint = hashlib.sha256(sock.getpeercert(binary_form=True)).hexdigest()
+    if (fingerprint, host) in _verified:
+        return
+    match_hostname(sock.getpeercert(), host)
+    with _lock:
+        _verified.add((fingerprint, host))
@@ -1,38 +1,118 @@
 from .parser import get_parser
 from .version import VERSION
 from .config import GlobalConfig
+from .follow import follow_batches, LogFormatter
+from .endpoints import EndpointCache
+from .cursors import LogCursors
+from . import envfile
+from . import manifest
+from . import parallel
 from ..client import RESTClient
+from ..client.client import Prefetch
+from ..client.memo import RequestMemo
 from ..client.errors import (RESTAPIError, AuthenticationNotConfigured,
-                             SSLVerificationError)
-from ..client.auth import BasicAuth, NullAuth, OAuth2Auth
+                             SSLVerificationError, DeadlineExceeded)
+from ..client.auth import BasicAuth, NullAuth, OAuth2Auth, token_expiry
 
 import sys
 import os
 import json
-import subprocess
 import re
 import time
 import shutil
-import getpass
-import urllib2
-import urllib
-import base64
 
 class CLI(object):
     __version__ = VERSION
-    def __init__(self, debug=False, endpoint=None):
-        self.client = RESTClient(endpoint=endpoint, debug=debug)
+    def __init__(self, debug=False, endpoint=None, cache=False, ssh_mux=False,
+                 compress_requests=None, agent=True):
+        self.endpoint = endpoint
         self.debug = debug
+        self.cache = cache
+        self.ssh_mux = ssh_mux
+        # Size above which request bodies are gzipped, None to never do it
+        self.compress_requests = compress_requests
+        # Send the API requests through the agent, when it's running
+        self.agent = agent
+        self._config_mtime = None
         self.error_handlers = {
             401: self.error_authen,
             403: self.error_authz,
             404: self.error_not_found,
             500: self.error_server,
         }
-        self.global_config = GlobalConfig()
-        self.setup_auth()
+        self._client = None
+        self._global_config = None
+        self.timings = None
+        self.timeout = None
+        self.deadline = None
+        self.hedge = None
+        self.format = 'text'
         self.cmd = os.path.basename(sys.argv[0])
 
+    # The API client and the global config are only set up when a command
+    # needs them: `app` or `env show` shouldn't pay for SSL and auth.
+    @property
+    def client(self):
+        if self._client is None:
+            agent = self.agent_client()
+            if agent is not None:
+                self._client = agent
+            else:
+                self._client = RESTClient(endpoint=self.endpoint, debug=self.debug)
+                if self.cache:
+                    from ..client.cache import ResponseCache
+                    self._client.cache = ResponseCache(self.global_config.path_to('cache'))
+                if self.compress_requests is not None:
+                    self._client.compress_threshold = self.compress_requests
+                self._client.hedge = self.hedge
+            if self.timings is not None:
+                self._client.add_timing_callback(self.timings.append)
+            self._client.timeout = self.timeout
+            self._client.deadline = self.deadline
+            # A command doesn't need to GET the same thing twice
+            self._client.memo = RequestMemo()
+            if agent is None:
+                self.setup_auth()
+        return self._client
+
+    def agent_client(self):
+        """Returns a client sending the requests through the agent, if it's
+        running for the same API endpoint."""
+        path = self.global_config.path_to('agent.sock')
+        if not self.agent or not os.path.exists(path):
+            return None
+        from ..client.agent import AgentClient
+        client = AgentClient(path, endpoint=self.endpoint, debug=self.debug)
+        try:
+            status = client.status()
+        except (IOError, ValueError):
+            return None
+        if status.get('endpoint') != self.endpoint:
+            return None
+        return client
+
+    def reload_auth(self):
+        """Sets the authentication up again when the global config changed,
+        e.g. after `setup`, or a token refreshed by another process."""
+        try:
+            mtime = os.path.getmtime(self.global_config.path)
+        except OSError:
+            return
+        if mtime != self._config_mtime:
+            self._config_mtime = mtime
+            self.global_config = GlobalConfig()
+            self.setup_auth()
+
+    @property
+    def global_config(self):
+        if self._global_config is None:
+            self._global_config = GlobalConfig()
+        return self._global_config
+
+    @global_config.setter
+    def global_config(self, config):
+        self._global_config = config
+
     def setup_auth(self):
         if self.global_config.get('token'):
             token = self.global_config.get('token')
@@ -42,26 +122,97 @@ class CLI(object):
                                                    scope=token['scope'],
                                                    client_id=client['key'],
                                                    client_secret=client['secret'],
-                                                   token_url=client['token_url'])
+                                                   token_url=client['token_url'],
+                                                   expires_at=token_expiry(token),
+                                                   lock=self.global_config.lock())
             self.client.authenticator.refresh_callback = lambda res: self.refresh_token(res)
+            self.client.authenticator.reload_callback = lambda: self.reload_token()
         elif self.global_config.get('apikey'):
             access_key, secret = self.global_config.get('apikey').split(':')
             self.client.authenticator = BasicAuth(access_key, secret)
 
     def refresh_token(self, res):
         self.info('Refreshed OAuth2 token')
-        self.global_config.data['token']['access_token'] = res['access_token']
-        self.global_config.data['token']['refresh_token'] = res['refresh_token']
+        token = self.global_config.data['token']
+        token['access_token'] = res['access_token']
+        token['refresh_token'] = res['refresh_token']
+        for key in ('expires_in', 'issued_at'):
+            if key in res:
+                token[key] = res[key]
+            else:
+                token.pop(key, None)
         self.global_config.save()
         return True
 
+    def reload_token(self):
+        # Another process may have refreshed the token in the meantime
+        self.global_config.load()
+        return self.global_config.get('token')
+
     def show_trace(self, id):
-        print '--> TraceID: ' + id
+        if self.ndjson:
+            print >>sys.stderr, '--> TraceID: ' + id
+        else:
+            print '--> TraceID: ' + id
+
+    @property
+    def ndjson(self):
+        return self.format == 'ndjson'
+
+    def emit(self, record):
+        """Writes `record` as one line of JSON, without waiting for the
+        rest of the output."""
+        sys.stdout.write(json.dumps(record) + '\n')
+        sys.stdout.flush()
+
+    def show_timings(self):
+        from ..client.timing import PHASES, summarize
+        timings = sorted(self.timings, key=lambda t: t.start)
+        elapsed = max(t.end for t in timings) - timings[0].start
+        print >>sys.stderr, '--> Timings: {0} requests in {1:.0f}ms'.format(
+            len(timings), elapsed * 1000)
+        for t in timings:
+            url = t.url
+            if url.startswith(self.client.endpoint):
+                url = url[len(self.client.endpoint):]
+            phases = ' '.join('{0} {1:.1f}'.format(phase, t.phases[phase] * 1000)
+                              for phase in PHASES if phase in t.phases)
+            extra = ' cached' if t.cached else (' reused' if t.reused else '')
+            if t.bytes_saved:
+                extra += ' gzip saved {0} bytes'.format(t.bytes_saved)
+            print >>sys.stderr, '    {0} {1} {2}: {3:.1f}ms ({4}){5}{6}'.format(
+                t.method, url, t.status or 'failed', t.total * 1000, phases, extra,
+                ' TraceID: {0}'.format(t.trace_id) if t.trace_id else '')
+        totals = summarize(timings)
+        print >>sys.stderr, '--> Total: ' + ', '.join(
+            '{0} {1:.1f}ms'.format(phase, totals[phase] * 1000) for phase in PHASES)
+        self.show_compression('--> ')
+        if self.client.memo.saved:
+            print >>sys.stderr, '--> {0} requests saved by reusing responses'.format(
+                self.client.memo.saved)
+
+    def show_compression(self, prefix):
+        stats = self.client.compression_stats
+        if stats['received'] or stats['sent']:
+            print >>sys.stderr, prefix + 'Compression: received {received} bytes for ' \
+                '{received_decompressed}, sent {sent} bytes for {sent_uncompressed} ' \
+                '({0} bytes saved)'.format(
+                    stats['received_decompressed'] - stats['received'] +
+                    stats['sent_uncompressed'] - stats['sent'], **stats)
 
     def run(self, args):
         p = get_parser(self.cmd)
         args = p.parse_args(args)
         self.load_config(args)
+        if args.timings:
+            self.timings = []
+        if args.ssh_mux:
+            self.ssh_mux = True
+        self.timeout = args.timeout
+        if args.deadline is not None:
+            self.deadline = time.time() + args.deadline
+        self.hedge = args.hedge_after or args.hedge or None
+        self.format = args.format
         if args.trace:
             self.client.trace = lambda(id): self.show_trace(id)
         cmd = 'cmd_{0}'.format(args.cmd)
@@ -69,19 +220,42 @@ class CLI(object):
             try:
                 getattr(self, cmd)(args)
             except AuthenticationNotConfigured:
-                print 'CLI authentication is not configured. Run `{0} setup` now.'.format(self.cmd)
+                self.fail('CLI authentication is not configured. Run `{0} setup` now.'.format(self.cmd))
             except RESTAPIError, e:
                 handler = self.error_handlers.get(e.code, self.default_error_handler)
                 handler(e)
             except KeyboardInterrupt:
                 pass
             except SSLVerificationError as e:
-                print 'SSL Connection to Dotcloud API failed: {0}'.format(str(e))
-            except urllib2.URLError as e:
-                print 'Accessing DotCloud API failed: {0}'.format(str(e))
+                self.fail('SSL Connection to Dotcloud API failed: {0}'.format(str(e)))
+            except DeadlineExceeded as e:
+                self.die('{0} after {1}s'.format(e, args.deadline))
+            except IOError as e:
+                # urllib2.URLError, only loaded once the API has been used,
+                # or socket.error from a body being read
+                urllib2 = sys.modules.get('urllib2')
+                socket = sys.modules.get('socket')
+                if not (urllib2 and isinstance(e, urllib2.URLError)) and \
+                        not (socket and isinstance(e, socket.error)):
+                    raise
+                self.fail('Accessing DotCloud API failed: {0}'.format(str(e)))
             finally:
                 if args.trace and self.client.trace_id:
                     self.show_trace(self.client.trace_id)
+                if self.timings:
+                    self.show_timings()
+                if self.debug and self._client:
+                    if hasattr(self._client, 'path'):
+                        print >>sys.stderr, '### requests sent through the agent at ' + self._client.path
+                    print >>sys.stderr, '### connections: {created} opened, ' \
+                        '{reused} reused, {discarded} discarded'.format(**self.client.pool.stats)
+                    tls = self.client.tls_stats
+                    if tls and tls['handshakes']:
+                        print >>sys.stderr, '### TLS: {handshakes} handshakes ' \
+                            'in {handshake_time:.3f}s'.format(**tls)
+                    self.show_compression('### ')
+                    print >>sys.stderr, '### {0} requests saved by reusing responses'.format(
+                        self.client.memo.saved)
 
     def app_local(func):
         def wrapped(self, args):
@@ -132,7 +306,16 @@ class CLI(object):
         print >>sys.stderr, message
         sys.exit(1)
 
+    def fail(self, message):
+        """Reports why the command couldn't run: on stdout as always in
+        text mode, while NDJSON output keeps stdout for the records and
+        exits with an error."""
+        if self.ndjson:
+            self.die(message)
+        print message
+
     def prompt(self, prompt, noecho=False):
+        import getpass
         method = getpass.getpass if noecho else raw_input
         input = method(prompt + ': ')
         return input
@@ -161,7 +344,7 @@ class CLI(object):
 
     def error_server(self, e):
         if self.client.trace_id:
-            print '--> TraceID: {0}'.format(self.client.trace_id)
+            self.show_trace(self.client.trace_id)
         self.die('Server Error: {0}'.format(e.desc))
 
     def cmd_version(self, args):
@@ -190,7 +373,9 @@ class CLI(object):
             self.die('Username and password do not match. Try again.')
         self.info('Registered the CLI client')
         try:
+            issued_at = time.time()
             token = self.authorize_client(urlmap.get('token'), credential, username, password)
+            token.setdefault('issued_at', issued_at)
         except Exception as e:
             self.die('Authorizing CLI error: {0}'.format(e))
         config = GlobalConfig()
@@ -202,12 +387,17 @@ class CLI(object):
         self.info('DotCloud authentication is complete! You are recommended to run `{cmd} check` now.'.format(cmd=self.cmd))
 
     def register_client(self, url, username, password):
+        import urllib
+        import urllib2
         req = urllib2.Request(url)
         req.add_data(urllib.urlencode({ 'username': username, 'password': password }))
         res = urllib2.urlopen(req)
         return json.load(res)
 
     def authorize_client(self, url, credential, username, password):
+        import base64
+        import urllib
+        import urllib2
         req = urllib2.Request(url)
         user_pass = '{0}:{1}'.format(urllib2.quote(credential['key']), urllib2.quote(credential['secret']))
         basic_auth = base64.b64encode(user_pass).strip()
@@ -232,9 +422,11 @@ class CLI(object):
             self.info('Retrieving push keys failed. You might have to run `{0} check` again'.format(self.cmd))
 
     def cmd_list(self, args):
-        res = self.client.get('/me/applications')
-        for app in sorted(res.items):
-            print app['name']
+        for app in self.client.iter_items('/me/applications'):
+            if self.ndjson:
+                self.emit(app)
+            else:
+                print app['name']
 
     def cmd_create(self, args):
         self.info('Creating a new application called "{0}"'.format(args.application))
@@ -286,7 +478,10 @@ class CLI(object):
             else:
                 self.die('Destroying the {0} "{1}" failed: {1}'.format(what_destroy, to_destroy, e))
         self.info('Destroyed.')
-        if args.service is None:
+        if args.service is not None:
+            self.endpoints.invalidate(args.application, args.environment, args.service)
+        else:
+            self.endpoints.invalidate(args.application)
             if self.config.get('application') == args.application:
                 self.destroy_config()
 
@@ -309,9 +504,10 @@ class CLI(object):
             print args.environment
         elif args.subcmd == 'list':
             url = '/me/applications/{0}/environments'.format(args.application)
-            res = self.client.get(url)
-            for data in res.items:
-                if data['name'] == args.environment:
+            for data in self.client.iter_items(url):
+                if self.ndjson:
+                    self.emit(dict(data, current=data['name'] == args.environment))
+                elif data['name'] == args.environment:
                     print '* ' + data['name']
                 else :
                     print '  ' + data['name']
@@ -336,12 +532,16 @@ class CLI(object):
         if args.subcmd == 'list':
             url = '/me/applications/{0}/environments/{1}/services'.format(args.application, args.environment)
             res = self.client.get(url)
-            for svc in res.items:
+            def get_aliases(svc):
                 url = '/me/applications/{0}/environments/{1}/services/{2}/aliases'\
                     .format(args.application, args.environment, svc.get('name'))
-                res = self.client.get(url)
-                for alias in res.items:
-                    print '{0}: {1}'.format(svc.get('name'), alias.get('alias'))
+                return svc, self.client.get(url).items
+            for svc, aliases in parallel.imap(get_aliases, res.items, args.parallel):
+                for alias in aliases:
+                    if self.ndjson:
+                        self.emit({'service': svc.get('name'), 'alias': alias.get('alias')})
+                    else:
+                        print '{0}: {1}'.format(svc.get('name'), alias.get('alias'))
         elif args.subcmd == 'add':
             url = '/me/applications/{0}/environments/{1}/services/{2}/aliases' \
                 .format(args.application, args.environment, args.service)
@@ -360,17 +560,12 @@ class CLI(object):
         if args.subcmd == 'list':
             var = self.client.get(url).item
             for name in sorted(var.keys()):
-                print '='.join((name, var.get(name)))
+                if self.ndjson:
+                    self.emit({'name': name, 'value': var.get(name)})
+                else:
+                    print '='.join((name, var.get(name)))
         elif args.subcmd == 'set':
-            patch = {}
-            for pair in args.values:
-                try:
-                    key, val = pair.split('=')
-                except ValueError:
-                    self.die('Usage: {0} var set KEY=VALUE ...'.format(self.cmd))
-                patch[key] = val
-            self.client.patch(url, patch)
-            deploy = True
+            deploy = self.set_variables(url, args)
         elif args.subcmd == 'unset':
             patch = {}
             for name in args.variables:
@@ -382,8 +577,43 @@ class CLI(object):
         if deploy:
             self.deploy(args.application, args.environment)
 
+    def set_variables(self, url, args):
+        """Sets the variables given as arguments or in a .env file, only
+        sending those which changed. Returns True if some did."""
+        if args.prune and not args.from_file:
+            self.die('--prune can only be used with --from-file')
+        wanted = {}
+        try:
+            for pair in args.values:
+                key, value = envfile.split_pair(pair)
+                wanted[key] = value
+            if args.from_file:
+                f = sys.stdin if args.from_file == '-' else open(args.from_file)
+                try:
+                    wanted.update(envfile.parse(f))
+                finally:
+                    if f is not sys.stdin:
+                        f.close()
+        except ValueError as e:
+            self.die('{0}. Usage: {1} var set KEY=VALUE ...'.format(e, self.cmd))
+        except IOError as e:
+            self.die('Cannot read {0}: {1}'.format(args.from_file, e.strerror))
+        if not wanted and not args.prune:
+            self.die('Usage: {0} var set KEY=VALUE ...'.format(self.cmd))
+        current = self.client.get(url).item or {}
+        patch = envfile.diff(current, wanted, prune=args.prune)
+        if not patch:
+            self.info('No variable changed, not deploying')
+            return False
+        removed = len([v for v in patch.itervalues() if v is None])
+        self.info('Setting {0} variables, removing {1}'.format(len(patch) - removed, removed))
+        for chunk in envfile.chunks(patch):
+            self.client.patch(url, chunk)
+        return True
+
     @app_local
     def cmd_scale(self, args):
+        import urllib2
         instances = {}
         for svc in args.services:
             try:
@@ -392,26 +622,90 @@ class CLI(object):
             except (ValueError, TypeError):
                 self.die('Usage: {0} scale service=number'.format(self.cmd))
             instances[name] = value
-        for name, value in instances.items():
+        def scale(item):
+            name, value = item
             url = '/me/applications/{0}/environments/{1}/services/{2}/instances' \
                 .format(args.application, args.environment, name)
-            self.info('Changing instances of {0} to {1}'.format(name, value))
-            self.client.put(url, { 'instances': value })
+            try:
+                self.client.put(url, { 'instances': value })
+            except (RESTAPIError, urllib2.URLError) as e:
+                return name, value, e
+            return name, value, None
+        self.info('Changing instances of {0}'.format(
+            ', '.join('{0} to {1}'.format(*i) for i in sorted(instances.items()))))
+        start = time.time()
+        failed = []
+        for name, value, error in parallel.imap(scale, sorted(instances.items()), args.parallel):
+            if error:
+                failed.append(name)
+                self.info('Changing instances of {0} to {1} failed: {2}'.format(name, value, error))
+            else:
+                self.info('Changed instances of {0} to {1}'.format(name, value))
+        self.info('Scaling took {0:.2f}s'.format(time.time() - start))
+        self.endpoints.invalidate(args.application, args.environment)
+        if failed:
+            self.die('Scaling {0} failed, not deploying.'.format(', '.join(failed)))
+        start = time.time()
         self.deploy(args.application, args.environment)
+        self.info('Deployment took {0:.2f}s'.format(time.time() - start))
 
     @app_local
     def cmd_info(self, args):
-        url = '/me/applications/{0}/environments/{1}/services'.format(args.application, args.environment)
-        res = self.client.get(url)
-        for service in res.items:
-            print '{0} (instances: {1})'.format(service['name'], len(service['instances']))
-            self.dump_service(service['instances'][0], indent=2)
-        url = '/me/applications/{0}'.format(args.application)
-        res = self.client.get(url)
-        snapshots = res.item.get('snapshots_enabled', False)
+        # The application details are fetched while the services are listed
+        app = Prefetch(self.client.get, '/me/applications/{0}'.format(args.application))
+        environments = self.selected_environments(args)
+        if environments is None:
+            url = '/me/applications/{0}/environments/{1}/services'.format(args.application, args.environment)
+            for service in self.client.iter_items(url):
+                self.show_service(args.environment, service)
+        else:
+            for env, services, error in self.fetch_services(args, environments):
+                self.show_environment(env, error)
+                for service in services:
+                    self.show_service(env, service)
+        snapshots = app.result().item.get('snapshots_enabled', False)
+        if self.ndjson:
+            self.emit({'application': args.application, 'snapshots_enabled': snapshots})
+            return
         print '--------'
         print 'Build snapshots: ' + ('enabled' if snapshots else 'disabled')
 
+    def show_environment(self, env, error):
+        if self.ndjson:
+            if error:
+                self.emit({'environment': env, 'error': str(error)})
+            return
+        print '=== {0}'.format(env)
+        if error:
+            print '  {0}'.format(error)
+
+    def show_service(self, env, service):
+        if self.ndjson:
+            self.emit(dict(service, environment=env))
+            return
+        print '{0} (instances: {1})'.format(service['name'], len(service['instances']))
+        self.dump_service(service['instances'][0], indent=2)
+
+    def selected_environments(self, args):
+        """Environments picked with --envs or --all-envs, None without them."""
+        if args.envs:
+            return args.envs
+        if args.all_envs:
+            url = '/me/applications/{0}/environments'.format(args.application)
+            return [env['name'] for env in self.client.iter_items(url)]
+        return None
+
+    def fetch_services(self, args, environments):
+        """Fetches the services of several environments concurrently, and
+        yields (environment, services, error) in the order given."""
+        def fetch(env):
+            url = '/me/applications/{0}/environments/{1}/services'.format(args.application, env)
+            try:
+                return env, list(self.client.iter_items(url)), None
+            except RESTAPIError as e:
+                return env, [], e
+        return parallel.imap(fetch, environments, args.parallel)
+
     def dump_service(self, instance, indent=0):
         def show(string):
             buf = ' ' * indent
@@ -428,28 +722,49 @@ class CLI(object):
 
     @app_local
     def cmd_url(self, args):
-        def cb(service, urls):
-            print '{0}: {1}'.format(service['name'], urls[0]['url'])
-        self.get_url(args.application, args.environment, cb)
+        def show(env, service, urls):
+            if self.ndjson:
+                self.emit({'environment': env, 'service': service['name'],
+                           'url': urls[0]['url']})
+            else:
+                print '{0}: {1}'.format(service['name'], urls[0]['url'])
+        environments = self.selected_environments(args)
+        if environments is None:
+            self.get_url(args.application, args.environment,
+                         lambda service, urls: show(args.environment, service, urls))
+            return
+        for env, services, error in self.fetch_services(args, environments):
+            self.show_environment(env, error)
+            for service, urls in self.service_urls(services):
+                show(env, service, urls)
 
     def get_url(self, application, environment, cb, type='http'):
         url = '/me/applications/{0}/environments/{1}/services'.format(application, environment)
         res = self.client.get(url)
-        for service in res.items:
+        for service, urls in self.service_urls(res.items, type):
+            cb(service, urls)
+
+    def service_urls(self, services, type='http'):
+        for service in services:
             instance = service['instances'][0]
             u = [p for p in instance.get('ports', []) if p['name'] == type]
             if len(u) > 0:
-                cb(service, u)
+                yield service, u
 
     @app_local
     def cmd_push(self, args):
         url = '/me/applications/{0}/push-url'.format(args.application)
         res = self.client.get(url)
         push_url = res.item.get('url')
-        self.rsync_code(push_url)
-        self.deploy(args.application, args.environment, create=True, clean=args.clean)
+        self.rsync_code(push_url, full=args.full)
+        try:
+            self.deploy(args.application, args.environment, create=True, clean=args.clean)
+        finally:
+            # Even a failed deploy may have replaced some instances
+            self.endpoints.invalidate(args.application, args.environment)
 
-    def rsync_code(self, push_url, local_dir='.'):
+    def rsync_code(self, push_url, local_dir='.', full=False):
+        import subprocess
         self.info('Syncing code from {0} to {1}'.format(local_dir, push_url))
         url = self.parse_url(push_url)
         ssh = ' '.join(self.common_ssh_options)
@@ -459,19 +774,57 @@ class CLI(object):
             local_dir += '/'
         ignore_file = os.path.join(local_dir, '.dotcloudignore')
         ignore_opt = ('--exclude-from', ignore_file) if os.path.exists(ignore_file) else tuple()
-        rsync = ('rsync', '-lpthrvz', '--delete', '--safe-links') + \
-                 tuple('--exclude={0}'.format(e) for e in excludes) + \
-                 ignore_opt + \
-                 ('-e', ssh, local_dir,
+
+        # The manifest records what the last push sent, so that unchanged
+        # trees aren't synced at all and small changes only send their files.
+        # Neither sync sends .dotcloud/: it only holds local state (config,
+        # manifest, cached endpoints, log cursors...).
+        manifest_path = os.path.join(local_dir, '.dotcloud', 'manifest')
+        patterns = list(excludes) + ['/.dotcloud']
+        try:
+            if ignore_opt:
+                patterns += manifest.read_ignore_file(ignore_file)
+            previous = manifest.Manifest.load(manifest_path)
+            if previous.push_url != push_url:
+                previous = manifest.Manifest()
+            current = manifest.Manifest(push_url,
+                manifest.scan(local_dir, patterns, previous.files))
+        except manifest.UnsupportedIgnoreRule:
+            previous = current = None
+        files_from = None
+        if current and previous.files and not full:
+            changed, removed = manifest.diff(previous.files, current.files)
+            if not changed and not removed:
+                self.info('No changes since the last push, skipping the code sync')
+                return 0
+            if not removed:
+                files_from = os.path.join(local_dir, '.dotcloud', 'push-files')
+                f = open(files_from, 'w')
+                f.write('\n'.join(changed) + '\n')
+                f.close()
+                self.info('Syncing {0} changed file(s)'.format(len(changed)))
+
+        if files_from:
+            rsync = ('rsync', '-lpthvz', '--safe-links', '--files-from', files_from)
+        else:
+            rsync = ('rsync', '-lpthrvz', '--delete', '--safe-links') + \
+                     tuple('--exclude={0}'.format(e) for e in excludes) + \
+                     ('--exclude=/.dotcloud/',) + ignore_opt
+        rsync += ('-e', ssh, local_dir,
                   '{user}@{host}:{dest}/'.format(user=url['user'],
                                                  host=url['host'], dest=url['path']))
         try:
             ret = subprocess.call(rsync, close_fds=True)
             if ret!= 0:
                 self.die('SSH connection failed')
+            if current and os.path.isdir(os.path.dirname(manifest_path)):
+                current.save(manifest_path)
             return ret
         except OSError:
             self.die('rsync failed')
+        finally:
+            if files_from:
+                os.unlink(files_from)
 
     def deploy(self, application, environment, create=False, clean=False):
         self.info('Deploying {1} environment for {0}'.format(application, environment))
@@ -487,53 +840,166 @@ class CLI(object):
             else:
                 raise
         url = '/me/applications/{0}/environments/{1}/build_logs'.format(application, environment)
-        while True:
-            res = self.client.get(url)
-            for item in res.items:
-                source = item.get('source', 'api')
-                if source == 'api':
-                    source = '-->'
-                else:
-                    source = '[{0}]'.format(source)
-                line = u'{0} {1} {2}'.format(
-                    time.strftime('%H:%M:%S', time.gmtime(item['timestamp'])),
-                    source,
-                    item['message'])
-                print line
-            next = res.find_link('next')
-            if not next:
-                break
-            url = next.get('href')
-            time.sleep(3)
+        self.log_cursors.store(application, environment, url)
+        self.show_build_logs(application, environment, url)
         def display_url(service, urls):
             self.info('Application is live at {0}'.format(urls[0]['url']))
         self.get_url(application, environment, display_url)
 
+    @property
+    def log_cursors(self):
+        return LogCursors(os.path.join('.dotcloud', 'build_logs'))
+
+    def show_build_logs(self, application, environment, url):
+        """Prints the build log from `url` until it's complete, keeping
+        track of where it was left in case we're interrupted."""
+        def cursor(url):
+            self.log_cursors.store(application, environment, url)
+        formatter = LogFormatter()
+        for batch in follow_batches(self.client, url, cursor=cursor):
+            sys.stdout.write(formatter.format(batch))
+            sys.stdout.flush()
+
+    @app_local
+    def cmd_logs(self, args):
+        url = '/me/applications/{0}/environments/{1}/build_logs'.format(
+            args.application, args.environment)
+        if args.follow:
+            url = self.log_cursors.get(args.application, args.environment) or url
+        self.show_build_logs(args.application, args.environment, url)
+
+    @property
+    def endpoints(self):
+        return EndpointCache(os.path.join('.dotcloud', 'endpoints'))
+
+    def ssh_urls(self, args, service, refresh=False):
+        """Returns the SSH URLs of the instances of `service` (None for
+        those without SSH access), and whether they came from the cache."""
+        if not refresh:
+            urls = self.endpoints.get(args.application, args.environment, service)
+            if urls is not None:
+                return urls, True
+        url = '/me/applications/{0}/environments/{1}/services/{2}'.format(args.application, args.environment, service)
+        res = self.client.get(url)
+        urls = []
+        for instance in res.item['instances']:
+            u = [p for p in instance.get('ports', []) if p['name'] == 'ssh']
+            urls.append(u[0]['url'] if u else None)
+        self.endpoints.store(args.application, args.environment, service, urls)
+        return urls, False
+
+    def refreshed_urls(self, args, service, urls):
+        """Fetches the SSH URLs again after a connection failure; returns
+        them with the indexes of the instances whose URL changed."""
+        self.info('Connection failed, refreshing the {0} endpoints'.format(service))
+        fresh, _ = self.ssh_urls(args, service, refresh=True)
+        changed = [i for i, u in enumerate(fresh)
+                   if u and (i >= len(urls) or urls[i] != u)]
+        return fresh, changed
+
     @app_local
     def cmd_ssh(self, args):
         # TODO support www.1
-        url = '/me/applications/{0}/environments/{1}/services/{2}'.format(args.application, args.environment, args.service)
-        res = self.client.get(url)
-        for service in res.items:
-            ports = service['instances'][0].get('ports', [])
-            u = [p for p in ports if p['name'] == 'ssh']
-            if len(u) > 0:
-                self.run_ssh(u[0]['url'], '$SHELL').wait()
+        self.ssh_instance(args, args.service, '$SHELL')
+
+    def ssh_instance(self, args, service, cmd):
+        """Runs `cmd` on the first instance of `service`."""
+        urls, cached = self.ssh_urls(args, service)
+        if not urls or not urls[0]:
+            return None
+        ret = self.run_ssh(urls[0], cmd).wait()
+        # ssh exits with 255 when it can't connect: the cached endpoint may
+        # be outdated, retry once if the API gives another one.
+        if ret == 255 and cached:
+            urls, changed = self.refreshed_urls(args, service, urls)
+            if 0 in changed:
+                ret = self.run_ssh(urls[0], cmd).wait()
+        return ret
 
     @app_local
     def cmd_run(self, args):
-        # TODO refactor with cmd_ssh
-        url = '/me/applications/{0}/environments/{1}/services/{2}'.format(args.application, args.environment, args.service)
-        res = self.client.get(url)
-        for service in res.items:
-            ports = service['instances'][0].get('ports', [])
-            u = [p for p in ports if p['name'] == 'ssh']
-            if len(u) > 0:
-                self.run_ssh(u[0]['url'], ' '.join(args.command)).wait()
+        name, indexes = self.parse_instances(args.service)
+        cmd = ' '.join(args.command)
+        if not args.all and indexes is None:
+            self.ssh_instance(args, name, cmd)
+            return
+        urls, cached = self.ssh_urls(args, name)
+        if indexes is None:
+            indexes = range(len(urls))
+        unknown = [i for i in indexes if i >= len(urls)]
+        if unknown:
+            self.die('Unknown instance: {0}.{1}'.format(name, unknown[0]))
+        results = self.run_instances(name, [(i, urls[i]) for i in indexes],
+                                     cmd, args.parallel)
+        if cached and 255 in results.values():
+            urls, changed = self.refreshed_urls(args, name, urls)
+            retry = [(i, urls[i]) for i in indexes if results[i] == 255 and i in changed]
+            results.update(self.run_instances(name, retry, cmd, args.parallel))
+        status = 0
+        for index in indexes:
+            ret = results[index]
+            if ret is None:
+                self.info('{0}.{1} has no SSH access'.format(name, index))
+                ret = 1
+            elif ret < 0:
+                # Killed by a signal: report it the way shells do
+                self.info('{0}.{1} was killed by signal {2}'.format(name, index, -ret))
+                ret = 128 - ret
+            elif ret != 0:
+                self.info('{0}.{1} exited with status {2}'.format(name, index, ret))
+            status = max(status, ret)
+        sys.exit(status)
+
+    def parse_instances(self, spec):
+        """Splits `www` into ('www', None) and `www.0,www.2` into
+        ('www', [0, 2])."""
+        names = set()
+        indexes = []
+        for instance in spec.split(','):
+            name, _, index = instance.rpartition('.')
+            if not name or not index.isdigit():
+                if len(spec.split(',')) > 1:
+                    self.die('Invalid instance: {0}'.format(instance))
+                return spec, None
+            names.add(name)
+            indexes.append(int(index))
+        if len(names) > 1:
+            self.die('Instances must belong to the same service')
+        return names.pop(), indexes
+
+    def run_instances(self, service, instances, cmd, limit=10):
+        """Runs `cmd` on `instances`, a list of (index, SSH URL), up to
+        `limit` at a time. Output lines are prefixed with the instance
+        name. Returns the exit status of each instance by index, None for
+        the ones without SSH access."""
+        import subprocess
+        import threading
+        lock = threading.Lock()
+        devnull = open(os.devnull)
+
+        def run(item):
+            index, url = item
+            if not url:
+                return index, None
+            name = '{0}.{1}'.format(service, index)
+            proc = self.run_ssh(url, cmd, tty=False, stdin=devnull,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            for line in iter(proc.stdout.readline, ''):
+                if not line.endswith('\n'):
+                    line += '\n'
+                with lock:
+                    sys.stdout.write('[{0}] {1}'.format(name, line))
+                    sys.stdout.flush()
+            return index, proc.wait()
+
+        try:
+            return dict(parallel.imap(run, instances, limit))
+        finally:
+            devnull.close()
 
     @property
     def common_ssh_options(self):
-        return (
+        options = (
             'ssh', '-t',
             '-i', self.global_config.key,
             '-o', 'LogLevel=QUIET',
@@ -542,16 +1008,96 @@ class CLI(object):
             '-o', 'PasswordAuthentication=no',
             '-o', 'ServerAliveInterval=10'
         )
+        if self.ssh_mux:
+            from . import mux
+            options += mux.control_options(self.global_config.path_to('ssh'))
+        return options
+
+    def cmd_agent(self, args):
+        from ..client.agent import AgentClient
+        path = self.global_config.path_to('agent.sock')
+        agent = AgentClient(path)
+        try:
+            status = agent.status()
+        except (IOError, ValueError):
+            status = None
+        if args.subcmd == 'status':
+            if status is None:
+                self.die('The agent is not running')
+            print 'Agent running (pid {pid}) for {endpoint}: up {uptime:.0f}s, ' \
+                '{requests} requests served'.format(**status)
+            print 'Connections: {created} opened, {reused} reused, ' \
+                '{discarded} discarded'.format(**status['connections'])
+        elif args.subcmd == 'stop':
+            if status is None:
+                self.die('The agent is not running')
+            agent.stop()
+            self.info('Agent stopped')
+        elif args.subcmd == 'start':
+            if status is not None:
+                self.info('The agent is already running (pid {0})'.format(status['pid']))
+                return
+            self.start_agent(path, args.foreground)
+
+    def start_agent(self, path, foreground=False):
+        from ..client.agent import AgentServer
+        # The agent sends the requests itself, with a response cache
+        self.agent = False
+        self.cache = True
+        self._config_mtime = os.path.getmtime(self.global_config.path) \
+            if os.path.exists(self.global_config.path) else None
+        server = AgentServer(path, self.client, before_request=self.reload_auth)
+        if not foreground:
+            pid = os.fork()
+            if pid:
+                server.socket.close()
+                self.info('Agent started (pid {0}), listening on {1}'.format(pid, path))
+                return
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if os.path.exists(path):
+                os.unlink(path)
+            if not foreground:
+                os._exit(0)
+
+    def cmd_mux(self, args):
+        from . import mux
+        masters = mux.masters(self.global_config.path_to('ssh'))
+        if args.subcmd == 'list':
+            for name, path in masters:
+                if mux.control(path, 'check'):
+                    print name
+                else:
+                    # Left behind by a master that didn't exit cleanly
+                    os.unlink(path)
+        elif args.subcmd == 'close':
+            for name, path in masters:
+                if args.names and name not in args.names:
+                    continue
+                if mux.control(path, 'exit'):
+                    self.info('Closed the connection to {0}'.format(name))
+                elif os.path.exists(path):
+                    os.unlink(path)
 
     def _escape(self, s):
         for c in ('`', '$', '"'):
             s = s.replace(c, '\\' + c)
         return s
 
-    def run_ssh(self, url, cmd, **kwargs):
+    def run_ssh(self, url, cmd, tty=True, **kwargs):
+        import subprocess
         self.info('Connecting to {0}'.format(url))
         res = self.parse_url(url)
-        options = self.common_ssh_options + (
+        options = self.common_ssh_options
+        if not tty:
+            options = tuple('-T' if o == '-t' else o for o in options)
+        options += (
             '-l', res.get('user', 'dotcloud'),
             '-p', res.get('port'),
             res.get('host'),
@@ -575,4 +1121,5 @@ class CLI(object):
         except RESTAPIError as e:
             if e.code == 404:
                 self.die('Service {0} not found'.format(args.service))
+        self.endpoints.invalidate(args.application, args.environment, args.service)
         self.info('Service {0} will be restarted.'.format(args.service))
@@ -1,6 +1,11 @@
 import os
 import json
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 class GlobalConfig(object):
     def __init__(self):
         self.dir = os.path.expanduser('~/.dotcloud2')
@@ -18,17 +23,24 @@ class GlobalConfig(object):
         try:
             self.data = json.load(file(self.path))
             self.loaded = True
-        except IOError:
+        except (IOError, ValueError):
             self.loaded = False
 
     def save(self):
         if not os.path.exists(self.dir):
             os.mkdir(self.dir, 0700)
+        # Other processes may read the file at any time: it's replaced
+        # at once rather than rewritten in place.
+        tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        f = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'w')
         try:
-            f = open(self.path, 'w+')
             json.dump(self.data, f)
-        except:
-            raise
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+
+    def lock(self):
+        return FileLock(self.path_to('config.lock'))
 
     def get(self, *args):
         if not self.loaded:
@@ -43,3 +55,26 @@ class GlobalConfig(object):
         except:
             pass
         f.close()
+
+class FileLock(object):
+    """Exclusive lock on a file, shared by all the CLI processes of the
+    user. It does nothing where fcntl isn't available."""
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        dir = os.path.dirname(self.path)
+        if not os.path.exists(dir):
+            os.mkdir(dir, 0700)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
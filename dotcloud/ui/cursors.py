@@ -0,0 +1,43 @@
+import json
+import os
+
+class LogCursors(object):
+    """URL of the next page of each build log being followed, kept in
+    `path` so that `logs --follow` can resume after an interrupted deploy.
+
+    Entries are keyed by application and environment."""
+    def __init__(self, path):
+        self.path = path
+
+    def key(self, application, environment):
+        return '{0}/{1}'.format(application, environment)
+
+    def load(self):
+        try:
+            return json.load(open(self.path))
+        except (IOError, ValueError):
+            return {}
+
+    def save(self, entries):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            return
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'w')
+        json.dump(entries, f)
+        f.close()
+        os.rename(tmp, self.path)
+
+    def get(self, application, environment):
+        return self.load().get(self.key(application, environment))
+
+    def store(self, application, environment, url):
+        """Records `url` as the cursor, or forgets it if `url` is None."""
+        entries = self.load()
+        key = self.key(application, environment)
+        if url is None:
+            if key not in entries:
+                return
+            del entries[key]
+        else:
+            entries[key] = url
+        self.save(entries)
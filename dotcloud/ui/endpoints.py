@@ -0,0 +1,56 @@
+import json
+import os
+import time
+
+class EndpointCache(object):
+    """SSH URLs of the service instances, kept in `path` for `ttl` seconds
+    so that `ssh` and `run` don't have to ask the API for them each time.
+
+    Entries are keyed by application, environment and service."""
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+
+    def key(self, application, environment, service):
+        return '{0}/{1}/{2}'.format(application, environment, service)
+
+    def load(self):
+        try:
+            return json.load(open(self.path))
+        except (IOError, ValueError):
+            return {}
+
+    def save(self, entries):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            return
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'w')
+        json.dump(entries, f)
+        f.close()
+        os.rename(tmp, self.path)
+
+    def get(self, application, environment, service):
+        """Returns the cached SSH URLs of the instances (None for those
+        without SSH access), or None if they're unknown or expired."""
+        entry = self.load().get(self.key(application, environment, service))
+        if entry is None or time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['urls']
+
+    def store(self, application, environment, service, urls):
+        entries = self.load()
+        entries[self.key(application, environment, service)] = {
+            'time': time.time(), 'urls': urls
+        }
+        self.save(entries)
+
+    def invalidate(self, application, environment=None, service=None):
+        """Forgets the endpoints of a service, of all the services of an
+        environment, or of the whole application."""
+        prefix = '/'.join(p for p in (application, environment, service) if p is not None)
+        entries = self.load()
+        keys = [k for k in entries if k == prefix or k.startswith(prefix + '/')]
+        if keys:
+            for k in keys:
+                del entries[k]
+            self.save(entries)
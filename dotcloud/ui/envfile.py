@@ -0,0 +1,75 @@
+import json
+import re
+
+KEY = re.compile(r'^[^\s=#]+$')
+ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', '"': '"', '\\': '\\'}
+
+def split_pair(pair):
+    """Splits `KEY=VALUE` on the first `=`: values may contain some.
+    UTF-8 input is decoded, to compare with the values of the API."""
+    if isinstance(pair, str):
+        pair = pair.decode('utf-8')
+    key, sep, value = pair.partition('=')
+    key = key.strip()
+    if not sep or not KEY.match(key):
+        raise ValueError('Expected KEY=VALUE, got {0!r}'.format(pair))
+    return key, value
+
+def unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == "'":
+        return value[1:-1]
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return re.sub(r'\\(.)', lambda m: ESCAPES.get(m.group(1), m.group(0)), value[1:-1])
+    # Unquoted values end at a comment
+    return re.sub(r'\s+#.*$', '', value)
+
+def parse(lines):
+    """Yields the (key, value) pairs of a .env file, as its lines are read.
+
+    Blank lines and comments are skipped, `export` prefixes are allowed
+    and values may be quoted; escapes are only honored in double quotes."""
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, str):
+            line = line.decode('utf-8')
+        line = line.rstrip('\r\n')
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if stripped.startswith('export '):
+            stripped = stripped[len('export '):]
+        try:
+            key, value = split_pair(stripped)
+        except ValueError:
+            raise ValueError('Line {0}: expected KEY=VALUE, got {1!r}'.format(number, line))
+        yield key, unquote(value)
+
+def diff(current, wanted, prune=False):
+    """Returns the patch turning the `current` variables into `wanted`:
+    new and changed values, and with `prune`, None for the variables
+    that aren't wanted anymore."""
+    patch = {}
+    for key, value in wanted.iteritems():
+        if current.get(key) != value:
+            patch[key] = value
+    if prune:
+        for key in current:
+            if key not in wanted:
+                patch[key] = None
+    return patch
+
+def chunks(patch, max_size=64 * 1024):
+    """Splits `patch` into patches whose JSON encoding is about `max_size`
+    bytes at most (a single variable may be bigger)."""
+    chunk = {}
+    size = 2
+    for key in sorted(patch):
+        item = len(json.dumps({key: patch[key]}))
+        if chunk and size + item > max_size:
+            yield chunk
+            chunk = {}
+            size = 2
+        chunk[key] = patch[key]
+        size += item
+    if chunk:
+        yield chunk
@@ -0,0 +1,81 @@
+import time
+
+class AdaptiveInterval(object):
+    """Delay between two polls of a paginated log: it resets to `minimum`
+    as soon as a page brings new lines, and doubles (up to `maximum`)
+    every time a page comes back empty."""
+
+    def __init__(self, minimum=0.5, maximum=3):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.current = minimum
+
+    def update(self, count):
+        if count:
+            self.current = self.minimum
+        else:
+            self.current = min(self.current * 2, self.maximum)
+        return self.current
+
+def follow_batches(client, url, interval=None, sleep=time.sleep, cursor=None):
+    """Yields the log items found at `url` until the log is complete, in
+    lists: one per page, or per chunk received when the log is streamed.
+
+    The log is streamed when the server supports it, otherwise the `next`
+    links are polled with an adaptive interval. `cursor(url)` is called
+    with each `next` link once the items before it have been consumed,
+    and with None when the log is complete."""
+    interval = interval or AdaptiveInterval()
+    res = client.stream(url)
+    while True:
+        count = 0
+        for batch in batches(res):
+            count += len(batch)
+            yield batch
+        next = res.find_link('next')
+        if not next:
+            break
+        if cursor:
+            cursor(next.get('href'))
+        sleep(interval.update(count))
+        res = client.get(next.get('href'), memo=False)
+    if cursor:
+        cursor(None)
+
+def batches(res):
+    if hasattr(res, 'batches'):
+        return res.batches
+    items = list(res.items)
+    return [items] if items else []
+
+def follow(client, url, interval=None, sleep=time.sleep, cursor=None):
+    """Yields the log items found at `url` one by one, see follow_batches()."""
+    for batch in follow_batches(client, url, interval, sleep, cursor):
+        for item in batch:
+            yield item
+
+class LogFormatter(object):
+    """Formats build log items into UTF-8 encoded lines, a batch at a
+    time. The clock time is computed once per second of log."""
+
+    def __init__(self):
+        self.second = None
+        self.clock = None
+
+    def time(self, timestamp):
+        second = int(timestamp)
+        if second != self.second:
+            self.second = second
+            self.clock = time.strftime('%H:%M:%S', time.gmtime(second))
+        return self.clock
+
+    def line(self, item):
+        source = item.get('source', 'api')
+        if source == 'api':
+            source = '-->'
+        else:
+            source = '[{0}]'.format(source)
+        return u'{0} {1} {2}\n'.format(self.time(item['timestamp']), source, item['message'])
+
+    def format(self, items):
+        return u''.join([self.line(item) for item in items]).encode('utf-8')
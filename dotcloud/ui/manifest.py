@@ -0,0 +1,121 @@
+import fnmatch
+import hashlib
+import json
+import os
+import stat
+
+class UnsupportedIgnoreRule(ValueError):
+    pass
+
+def read_ignore_file(path):
+    """Reads the exclude patterns of an rsync --exclude-from file.
+
+    Include rules can't be mirrored by the manifest scan, and raise
+    UnsupportedIgnoreRule."""
+    patterns = []
+    for line in open(path):
+        line = line.rstrip('\r\n')
+        if not line.strip() or line[0] in '#;':
+            continue
+        if line.startswith('- '):
+            line = line[2:]
+        elif line.startswith('+ ') or line.startswith('!'):
+            raise UnsupportedIgnoreRule(line)
+        patterns.append(line)
+    return patterns
+
+def is_excluded(path, is_dir, patterns):
+    """Tells if `path` (relative to the pushed directory) matches one of
+    the rsync exclude `patterns`."""
+    name = os.path.basename(path)
+    for pattern in patterns:
+        if pattern.endswith('/'):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip('/')
+        if pattern.startswith('/'):
+            if fnmatch.fnmatch(path, pattern[1:]):
+                return True
+        elif '/' in pattern:
+            if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(path, '*/' + pattern):
+                return True
+        elif fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+def file_hash(path):
+    h = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            h.update(data)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+def scan(root, patterns, previous=None):
+    """Returns {path: [size, mtime, mode, hash]} for everything rsync would
+    push from `root`. Files whose size, mtime and mode didn't change since
+    `previous` aren't hashed again."""
+    previous = previous or {}
+    entries = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        rel = '' if rel == '.' else rel
+        kept = []
+        for name in sorted(dirnames):
+            path = os.path.join(rel, name)
+            if is_excluded(path, True, patterns):
+                continue
+            if os.path.islink(os.path.join(dirpath, name)):
+                filenames.append(name)
+            else:
+                kept.append(name)
+                st = os.lstat(os.path.join(dirpath, name))
+                entries[path] = [0, 0, stat.S_IMODE(st.st_mode), None]
+        dirnames[:] = kept
+        for name in filenames:
+            path = os.path.join(rel, name)
+            if is_excluded(path, False, patterns):
+                continue
+            full = os.path.join(dirpath, name)
+            st = os.lstat(full)
+            entry = [st.st_size, st.st_mtime, stat.S_IMODE(st.st_mode), None]
+            old = previous.get(path)
+            if old and old[:3] == entry[:3]:
+                entry[3] = old[3]
+            elif stat.S_ISLNK(st.st_mode):
+                entry[3] = hashlib.sha1(os.readlink(full)).hexdigest()
+            else:
+                entry[3] = file_hash(full)
+            entries[path] = entry
+    return entries
+
+def diff(old, new):
+    """Returns the (changed, removed) paths between two scans."""
+    changed = sorted(path for path, entry in new.iteritems()
+                     if old.get(path) is None or old[path][2:] != entry[2:])
+    removed = sorted(path for path in old if path not in new)
+    return changed, removed
+
+class Manifest(object):
+    """What was pushed to `push_url` the last time the code was synced."""
+    def __init__(self, push_url=None, files=None):
+        self.push_url = push_url
+        self.files = files or {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            data = json.load(open(path))
+            return cls(data['push_url'], data['files'])
+        except (IOError, ValueError, KeyError):
+            return cls()
+
+    def save(self, path):
+        f = open(path, 'w')
+        json.dump({'push_url': self.push_url, 'files': self.files}, f)
+        f.close()
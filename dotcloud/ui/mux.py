@@ -0,0 +1,39 @@
+import os
+import stat
+import subprocess
+
+def control_options(directory, persist=600):
+    """ssh options sharing one master connection per user, host and port,
+    kept open `persist` seconds after its last client is done."""
+    if not os.path.exists(directory):
+        os.makedirs(directory, 0700)
+    return (
+        '-o', 'ControlMaster=auto',
+        '-o', 'ControlPath={0}'.format(os.path.join(directory, '%r@%h:%p')),
+        '-o', 'ControlPersist={0}'.format(persist)
+    )
+
+def masters(directory):
+    """Returns the (name, path) of the control sockets in `directory`."""
+    if not os.path.isdir(directory):
+        return []
+    sockets = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            sockets.append((name, path))
+    return sockets
+
+def control(path, command):
+    """Sends a control `command` (check, exit...) to the master listening
+    on `path`, and tells if it succeeded."""
+    name = os.path.basename(path)
+    user, _, host = name.partition('@')
+    host, _, port = host.rpartition(':')
+    devnull = open(os.devnull, 'w')
+    try:
+        return subprocess.call(('ssh', '-O', command, '-S', path,
+                                '-l', user, '-p', port, host),
+                               stdout=devnull, stderr=devnull, close_fds=True) == 0
+    finally:
+        devnull.close()
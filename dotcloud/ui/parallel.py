@@ -0,0 +1,21 @@
+def imap(func, items, parallel=4):
+    """Like itertools.imap, but runs up to `parallel` calls of `func` at
+    once in worker threads. Results are yielded in the order of `items`
+    as soon as they (and all the previous ones) are available."""
+    items = list(items)
+    if parallel <= 1 or len(items) <= 1:
+        for item in items:
+            yield func(item)
+        return
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(parallel, len(items)))
+    try:
+        results = pool.imap(func, items)
+        while True:
+            try:
+                # A timeout keeps the wait interruptible with ^C
+                yield results.next(timeout=86400)
+            except StopIteration:
+                break
+    finally:
+        pool.terminate()
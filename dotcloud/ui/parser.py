@@ -1,12 +1,35 @@
 import argparse
 from .version import VERSION
 
+def add_environments_arguments(parser):
+    parser.add_argument('--all-envs', action='store_true',
+                        help='Show all the environments of the application')
+    parser.add_argument('--envs', type=lambda s: s.split(','), metavar='ENV[,ENV...]',
+                        help='Show the given environments')
+    parser.add_argument('--parallel', '-p', type=int, default=4, metavar='N',
+                        help='Number of environments to query at the same time')
+
 def get_parser(name='dotcloud'):
     parser = argparse.ArgumentParser(prog=name, description='dotcloud CLI')
     parser.add_argument('--application', '-A', help='specify the application')
     parser.add_argument('--environment', '-E', help='specify the environment')
     parser.add_argument('--version', '-v', action='version', version='dotcloud/{0}'.format(VERSION))
     parser.add_argument('--trace', action='store_true', help='Display trace ID')
+    parser.add_argument('--timings', action='store_true',
+                        help='Display the latency breakdown of the API requests')
+    parser.add_argument('--ssh-mux', action='store_true',
+                        help='Share SSH connections between commands (see `mux`)')
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                        help='Give up on API requests stalled for that long')
+    parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                        help='Fail if the API requests of the command take longer than that')
+    parser.add_argument('--hedge', action='store_true',
+                        help='Send GETs slower than the 95th percentile of the latencies again')
+    parser.add_argument('--hedge-after', type=float, metavar='SECONDS',
+                        help='Send GETs slower than that again')
+    parser.add_argument('--format', choices=('text', 'ndjson'), default='text',
+                        help='Output of list, info, url, env/alias/var list: text, '
+                        'or one JSON record per line (ndjson)')
     
     subcmd = parser.add_subparsers(dest='cmd')
 
@@ -31,15 +54,22 @@ def get_parser(name='dotcloud'):
 
     info = subcmd.add_parser('info', help='Get information about the application')
     info.add_argument('service', nargs='?', help='Specify the service')
+    add_environments_arguments(info)
 
     url = subcmd.add_parser('url', help='Show URL for the application')
     url.add_argument('service', nargs='?', help='Specify the service')
+    add_environments_arguments(url)
 
     ssh = subcmd.add_parser('ssh', help='SSH into the service')
     ssh.add_argument('service', help='Specify the service')
 
     run = subcmd.add_parser('run', help='SSH into the service')
-    run.add_argument('service', help='Specify the service')
+    run.add_argument('service',
+                     help='Specify the service, or instances e.g. www.1 or www.0,www.2')
+    run.add_argument('--all', action='store_true',
+                     help='Run the command on all the instances of the service')
+    run.add_argument('--parallel', '-p', type=int, default=10, metavar='N',
+                     help='Number of instances to run the command on at the same time')
     run.add_argument('command', nargs='+', help='Run a command on the service')
 
     env = subcmd.add_parser('env', help='Manipulate application environments') \
@@ -55,6 +85,12 @@ def get_parser(name='dotcloud'):
 
     push = subcmd.add_parser('push', help='Push the code')
     push.add_argument('--clean', action='store_true', help='clean build')
+    push.add_argument('--full', action='store_true',
+                      help='sync the whole tree, even files unchanged since the last push')
+
+    logs = subcmd.add_parser('logs', help='Show the build log of the last push')
+    logs.add_argument('--follow', '-f', action='store_true',
+                      help='resume from where the last push or logs --follow was interrupted')
 
     var = subcmd.add_parser('var', help='Manipulate application variables') \
         .add_subparsers(dest='subcmd')
@@ -62,19 +98,42 @@ def get_parser(name='dotcloud'):
     var_set = var.add_parser('set', help='Set new application variables')
     var_set.add_argument('values', help='Application variables to set',
                          metavar='key=value', nargs='*')
+    var_set.add_argument('--from-file', '-f', metavar='PATH',
+                         help='read the variables from a .env file, or stdin with -')
+    var_set.add_argument('--prune', action='store_true',
+                         help='unset the variables which are not in the file')
     var_unset = var.add_parser('unset', help='Unset application variables')
     var_unset.add_argument('variables', help='Application ariables to unset', metavar='var', nargs='*')
 
     scale = subcmd.add_parser('scale', help='Scale services')
     scale.add_argument('services', nargs='*', metavar='service=count',
                        help='Number of instances to set for each service e.g. www=2')
+    scale.add_argument('--parallel', '-p', type=int, default=4, metavar='N',
+                       help='Number of services to scale at the same time')
 
     restart = subcmd.add_parser('restart', help='Restart the service')
     restart.add_argument('service', help='Specify the service')
 
+    agent = subcmd.add_parser('agent', help='Manage the background agent') \
+        .add_subparsers(dest='subcmd')
+    agent_start = agent.add_parser('start', help='Start the agent')
+    agent_start.add_argument('--foreground', action='store_true',
+                             help='Do not detach from the terminal')
+    agent_stop = agent.add_parser('stop', help='Stop the agent')
+    agent_status = agent.add_parser('status', help='Show the agent status')
+
+    mux = subcmd.add_parser('mux', help='Manage the shared SSH connections') \
+        .add_subparsers(dest='subcmd')
+    mux_list = mux.add_parser('list', help='List the open connections')
+    mux_close = mux.add_parser('close', help='Close connections')
+    mux_close.add_argument('names', nargs='*', metavar='user@host:port',
+                           help='Connections to close (all of them by default)')
+
     alias = subcmd.add_parser('alias', help='Manage aliases for the service') \
         .add_subparsers(dest='subcmd')
     alias_list = alias.add_parser('list', help='List the aliases')
+    alias_list.add_argument('--parallel', '-p', type=int, default=4, metavar='N',
+                            help='Number of services to query at the same time')
     alias_add = alias.add_parser('add', help='Add a new alias')
     alias_add.add_argument('service', help='Service to set alias for')
     alias_add.add_argument('alias', help='New alias (domain name)')
@@ -0,0 +1,29 @@
+import threading
+import time
+
+from dotcloud.client.auth import OAuth2Auth
+
+def test_expiring():
+    auth = OAuth2Auth(access_token='a', expires_at=time.time() + 30)
+    assert auth.expiring
+    auth.expires_at = time.time() + 3600
+    assert not auth.expiring
+    assert not OAuth2Auth(access_token='a').expiring
+
+def test_single_refresh_adopts_token_from_disk():
+    auth = OAuth2Auth(access_token='old', refresh_token='r')
+    reloads = []
+    def reload():
+        reloads.append(1)
+        time.sleep(0.05)
+        return {'access_token': 'new', 'refresh_token': 'r2',
+                'issued_at': time.time(), 'expires_in': 3600}
+    auth.reload_callback = reload
+    threads = [threading.Thread(target=auth.refresh, args=('old',)) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(reloads) == 1
+    assert auth.access_token == 'new' and auth.refresh_token == 'r2'
+    assert not auth.expiring
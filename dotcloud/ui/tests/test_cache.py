@@ -0,0 +1,71 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'benchmarks'))
+from stub_api import StubAPI
+from dotcloud.client import RESTClient
+from dotcloud.client.auth import NullAuth
+from dotcloud.client.cache import ResponseCache
+
+class FakeResponse(object):
+    code = 200
+    headers = {'ETag': '"v1"', 'Content-Type': 'application/json'}
+
+def test_store_and_invalidate(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.store('http://api/1/me/applications', FakeResponse(), '{}')
+    cache.store('http://api/1/me/applications/foo/environments', FakeResponse(), '{}')
+    cache.store('http://api/1/me/applications/foobar', FakeResponse(), '{}')
+    assert cache.get('http://api/1/me/applications')['etag'] == '"v1"'
+    cache.invalidate('http://api/1/me/applications/foo')
+    assert cache.get('http://api/1/me/applications') is None
+    assert cache.get('http://api/1/me/applications/foo/environments') is None
+    assert cache.get('http://api/1/me/applications/foobar') is not None
+
+def test_evict_by_size(tmpdir):
+    cache = ResponseCache(str(tmpdir), max_size=10)
+    cache.store('http://api/1/a', FakeResponse(), '0123456789')
+    cache.store('http://api/1/b', FakeResponse(), '0123456789')
+    assert cache.get('http://api/1/a') is None
+    assert cache.get('http://api/1/b') is not None
+
+def test_cached_responses_are_not_streamed(tmpdir):
+    from dotcloud.client.response import StreamingListResponse
+
+    api = StubAPI().start()
+    try:
+        client = RESTClient(api.endpoint, cache=ResponseCache(str(tmpdir)))
+        client.authenticator = NullAuth()
+        fresh = client.get_page('/me/applications')
+        cached = client.get_page('/me/applications')
+        assert not isinstance(fresh, StreamingListResponse)
+        assert not isinstance(cached, StreamingListResponse)
+        assert cached.items[0] == fresh.items[0] == {'name': 'app0'}
+    finally:
+        api.stop()
+
+def test_hedged_get_revalidates_cached_response(tmpdir):
+    release = threading.Event()
+    log = []
+
+    def me(self, body, query):
+        if self.headers.get('If-None-Match') and not log:
+            # The first revalidation hangs until the test is over
+            log.append('slow')
+            release.wait(5)
+            log.append('slow done')
+        self.send_json(200, {'object': {'username': 'bench'}})
+    api = StubAPI().start()
+    api.routes.insert(0, ('GET', r'/1/me', me))
+    try:
+        client = RESTClient(api.endpoint, cache=ResponseCache(str(tmpdir)))
+        client.authenticator = NullAuth()
+        client.retries = 0
+        assert client.get('/me', memo=False).item == {'username': 'bench'}
+        client.hedge = 0.05
+        assert client.get('/me', memo=False).item == {'username': 'bench'}
+        assert log == ['slow']
+    finally:
+        release.set()
+        api.stop()
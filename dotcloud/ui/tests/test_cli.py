@@ -0,0 +1,242 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'benchmarks'))
+from stub_api import StubAPI
+from dotcloud.client.errors import RESTAPIError
+from dotcloud.ui import CLI
+
+def start_api(tmpdir, monkeypatch, **kwargs):
+    """Starts a stub API, with the CLI configured for it in `tmpdir`."""
+    api = StubAPI(**kwargs).start()
+    monkeypatch.setenv('HOME', str(tmpdir))
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.mkdir('.dotcloud2').join('config').write(json.dumps({'apikey': 'key:secret'}))
+    tmpdir.mkdir('.dotcloud').join('config').write(
+        json.dumps({'application': 'app', 'environment': 'default'}))
+    return api
+
+def run(api, capsys, *args):
+    """Runs the CLI, returning its exit status and output."""
+    try:
+        CLI(endpoint=api.endpoint, agent=False).run(list(args))
+        status = 0
+    except SystemExit, e:
+        status = e.code
+    out, err = capsys.readouterr()
+    return status, out, err
+
+def test_ndjson_output(tmpdir, monkeypatch, capsys):
+    api = start_api(tmpdir, monkeypatch, services=2, environments=2, variables=2)
+    try:
+        status, out, err = run(api, capsys, '--format', 'ndjson', 'list')
+        assert [json.loads(l) for l in out.splitlines()] == \
+            [{'name': 'app{0}'.format(i)} for i in range(10)]
+        status, out, err = run(api, capsys, '--format', 'ndjson', 'env', 'list')
+        assert [json.loads(l) for l in out.splitlines()] == [
+            {'name': 'default', 'current': True}, {'name': 'env1', 'current': False}]
+        status, out, err = run(api, capsys, '--format', 'ndjson', 'var', 'list')
+        assert [json.loads(l) for l in out.splitlines()] == [
+            {'name': 'VAR0', 'value': 'value0'}, {'name': 'VAR1', 'value': 'value1'}]
+        status, out, err = run(api, capsys, '--format', 'ndjson', 'alias', 'list')
+        assert [json.loads(l) for l in out.splitlines()] == [
+            {'service': 'svc0', 'alias': 'svc0.example.com'},
+            {'service': 'svc1', 'alias': 'svc1.example.com'}]
+        status, out, err = run(api, capsys, '--format', 'ndjson', 'url')
+        assert json.loads(out.splitlines()[0]) == {
+            'environment': 'default', 'service': 'svc0', 'url': 'http://svc0.app.example.com'}
+        status, out, err = run(api, capsys, '--format', 'ndjson', 'info')
+        records = [json.loads(l) for l in out.splitlines()]
+        assert [(r.get('environment'), r.get('name')) for r in records[:2]] == \
+            [('default', 'svc0'), ('default', 'svc1')]
+        assert records[2] == {'application': 'app', 'snapshots_enabled': False}
+        # Messages don't get mixed with the records
+        status, out, err = run(api, capsys, '--format', 'ndjson', 'var', 'set', 'VAR0=value0')
+        assert out == '' and 'No variable changed' in err
+        cli = CLI(endpoint=api.endpoint, agent=False)
+        cli.format = 'ndjson'
+        cli.show_trace('trace-1')
+        out, err = capsys.readouterr()
+        assert out == '' and 'trace-1' in err
+    finally:
+        api.stop()
+
+def test_ndjson_errors(tmpdir, monkeypatch, capsys):
+    import socket
+
+    def broken(self, body, query):
+        error = json.dumps({'error': {'description': 'Broken'}})
+        self.send_response(500)
+        self.send_header('X-DotCloud-TraceID', 'trace-2')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(error)))
+        self.end_headers()
+        self.wfile.write(error)
+    api = start_api(tmpdir, monkeypatch)
+    api.routes.insert(0, ('GET', r'/1/me/applications', broken))
+    try:
+        status, out, err = run(api, capsys, '--format', 'ndjson', 'list')
+        assert status == 1 and out == ''
+        assert 'Server Error: Broken' in err
+        cli = CLI(endpoint=api.endpoint, agent=False)
+        cli.format = 'ndjson'
+        cli.client.trace_id = 'trace-2'
+        try:
+            cli.error_server(RESTAPIError(code=500, desc='Broken'))
+        except SystemExit:
+            pass
+        out, err = capsys.readouterr()
+        assert out == '' and 'trace-2' in err
+    finally:
+        api.stop()
+    # Nothing listens on the port of a socket bound but not listening
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    try:
+        endpoint = 'http://127.0.0.1:{0}/1'.format(sock.getsockname()[1])
+        try:
+            CLI(endpoint=endpoint, agent=False).run(['--format', 'ndjson', 'list'])
+            status = 0
+        except SystemExit, e:
+            status = e.code
+        out, err = capsys.readouterr()
+        assert status == 1 and out == ''
+        assert 'Accessing DotCloud API failed' in err
+    finally:
+        sock.close()
+
+def test_parse_instances():
+    cli = CLI()
+    assert cli.parse_instances('www') == ('www', None)
+    assert cli.parse_instances('www.1') == ('www', [1])
+    assert cli.parse_instances('www.0,www.2') == ('www', [0, 2])
+    for spec in ('www.0,db.1', 'www.0,db'):
+        try:
+            cli.parse_instances(spec)
+            assert False
+        except SystemExit, e:
+            assert e.code == 1
+
+def test_run_exit_status(tmpdir, monkeypatch, capsys):
+    # Instances of the stub listen on ports 2200, 2201...: the second fails
+    ssh = tmpdir.mkdir('bin').join('ssh')
+    ssh.write('#!/bin/sh\n'
+              'for a in "$@"; do [ "$prev" = -p ] && port=$a; prev=$a; done\n'
+              'echo "ran on $port"\n'
+              '[ "$port" = 2201 ] && exit 3\n'
+              'exit 0\n')
+    ssh.chmod(0755)
+    monkeypatch.setenv('PATH', '{0}:{1}'.format(tmpdir.join('bin'), os.environ['PATH']))
+    api = start_api(tmpdir, monkeypatch)
+    try:
+        status, out, err = run(api, capsys, 'run', '--all', 'svc0', 'true')
+        assert status == 3
+        assert sorted(out.splitlines()) == ['[svc0.0] ran on 2200', '[svc0.1] ran on 2201']
+        assert 'svc0.1 exited with status 3' in err
+        status, out, err = run(api, capsys, 'run', 'svc0.0', 'true')
+        assert status == 0 and out == '[svc0.0] ran on 2200\n'
+    finally:
+        api.stop()
+
+def test_run_exit_status_of_killed_instance(tmpdir, monkeypatch, capsys):
+    ssh = tmpdir.mkdir('bin').join('ssh')
+    ssh.write('#!/bin/sh\n'
+              'for a in "$@"; do [ "$prev" = -p ] && port=$a; prev=$a; done\n'
+              '[ "$port" = 2201 ] && kill -9 $$\n'
+              'exit 0\n')
+    ssh.chmod(0755)
+    monkeypatch.setenv('PATH', '{0}:{1}'.format(tmpdir.join('bin'), os.environ['PATH']))
+    api = start_api(tmpdir, monkeypatch)
+    try:
+        status, out, err = run(api, capsys, 'run', '--all', 'svc0', 'true')
+        assert status == 128 + 9
+        assert 'svc0.1 was killed by signal 9' in err
+    finally:
+        api.stop()
+
+def test_envs_order_and_errors(tmpdir, monkeypatch, capsys):
+    import time
+
+    def services(self, body, query, app, env):
+        if env == 'broken':
+            return self.send_json(404, {'error': {'description': 'No such environment'}})
+        # The first environments asked for are the slowest to answer
+        time.sleep({'env2': 0.2, 'env1': 0.1}.get(env, 0))
+        self.send_json(200, {'objects': [self.server.make_service('svc-' + env)]})
+    api = start_api(tmpdir, monkeypatch, environments=3)
+    api.routes.insert(0, ('GET', r'/1/me/applications/([^/]+)/environments/([^/]+)/services',
+                          services))
+    try:
+        status, out, err = run(api, capsys, '--format', 'ndjson', 'url',
+                               '--envs', 'env2,broken,env1,default')
+        records = [json.loads(l) for l in out.splitlines()]
+        assert [(r['environment'], r.get('service') or r.get('error')) for r in records] == [
+            ('env2', 'svc-env2'), ('broken', 'No such environment'),
+            ('env1', 'svc-env1'), ('default', 'svc-default')]
+        status, out, err = run(api, capsys, 'info', '--envs', 'env2,broken,env1,default')
+        lines = out.splitlines()
+        assert [l for l in lines if l.startswith('===')] == [
+            '=== env2', '=== broken', '=== env1', '=== default']
+        assert lines[lines.index('=== broken') + 1] == '  No such environment'
+    finally:
+        api.stop()
+
+def test_scale_failure_skips_deploy(tmpdir, monkeypatch, capsys):
+    deploys = []
+
+    def fail(self, body, query, app, env):
+        self.send_json(500, {'error': {'description': 'Out of capacity'}})
+
+    def revision(self, body, query, app, env):
+        deploys.append(env)
+        self.send_json(200, {'object': {}})
+    api = start_api(tmpdir, monkeypatch)
+    env = r'/1/me/applications/([^/]+)/environments/([^/]+)'
+    api.routes[:0] = [('PUT', env + r'/services/svc1/instances', fail),
+                      ('PUT', env + r'/revision', revision)]
+    try:
+        status, out, err = run(api, capsys, 'scale', 'svc0=2', 'svc1=3')
+        assert status == 1
+        assert 'Changed instances of svc0 to 2' in err
+        assert 'Changing instances of svc1 to 3 failed' in err
+        assert 'not deploying' in err
+        assert deploys == []
+    finally:
+        api.stop()
+
+def test_failed_push_forgets_endpoints(tmpdir, monkeypatch, capsys):
+    def fail(self, body, query, app, env):
+        self.send_json(500, {'error': {'description': 'Build failed'}})
+    rsync = tmpdir.mkdir('bin').join('rsync')
+    rsync.write('#!/bin/sh\nexit 0\n')
+    rsync.chmod(0755)
+    monkeypatch.setenv('PATH', '{0}:{1}'.format(tmpdir.join('bin'), os.environ['PATH']))
+    api = start_api(tmpdir, monkeypatch)
+    env = r'/1/me/applications/([^/]+)/environments/([^/]+)'
+    api.routes.insert(0, ('PUT', env + r'/revision', fail))
+    try:
+        cli = CLI(endpoint=api.endpoint, agent=False)
+        cli.endpoints.store('app', 'default', 'svc0', ['ssh://dotcloud@host:2200'])
+        status, out, err = run(api, capsys, 'push')
+        assert status == 1
+        assert cli.endpoints.get('app', 'default', 'svc0') is None
+    finally:
+        api.stop()
+
+def test_alias_list_order_with_parallel(tmpdir, monkeypatch, capsys):
+    import time
+
+    def aliases(self, body, query, app, env, name):
+        # The first services are the slowest to answer
+        time.sleep(0.05 * (4 - int(name[3:])))
+        self.send_json(200, {'objects': [{'alias': name + '-a'}, {'alias': name + '-b'}]})
+    api = start_api(tmpdir, monkeypatch, services=4)
+    api.routes.insert(0, ('GET', r'/1/me/applications/([^/]+)/environments/([^/]+)'
+                                 r'/services/([^/]+)/aliases', aliases))
+    try:
+        status, out, err = run(api, capsys, 'alias', 'list', '--parallel', '4')
+        assert out.splitlines() == ['svc{0}: svc{0}-{1}'.format(i, s)
+                                    for i in range(4) for s in 'ab']
+    finally:
+        api.stop()
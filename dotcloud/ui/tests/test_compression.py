@@ -0,0 +1,26 @@
+import StringIO
+import zlib
+
+from dotcloud.client.compression import DecompressingReader, compress
+
+def test_gzip_round_trip():
+    data = '{"objects": [' + ', '.join(['{"a": 1}'] * 1000) + ']}'
+    sizes = []
+    reader = DecompressingReader(StringIO.StringIO(compress(data)), 'gzip',
+                                 lambda c, d: sizes.append((c, d)))
+    chunks = []
+    while True:
+        chunk = reader.read_chunk(64)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert ''.join(chunks) == data
+    assert sum(d for c, d in sizes) == len(data)
+    assert sum(c for c, d in sizes) < len(data) / 10
+
+def test_raw_deflate():
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress('hello\nworld\n') + compressor.flush()
+    reader = DecompressingReader(StringIO.StringIO(body), 'deflate')
+    assert reader.readline() == 'hello\n'
+    assert reader.read() == 'world\n'
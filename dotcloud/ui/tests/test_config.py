@@ -0,0 +1,18 @@
+import os
+
+from dotcloud.ui.config import GlobalConfig
+
+def test_save_replaces_the_file(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    config = GlobalConfig()
+    assert not config.loaded
+    config.data = {'apikey': 'a:b'}
+    config.save()
+    assert os.listdir(config.dir) == ['config']
+    assert oct(os.stat(config.path).st_mode & 0777) == '0600'
+    assert GlobalConfig().get('apikey') == 'a:b'
+
+def test_load_partial_file(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    tmpdir.mkdir('.dotcloud2').join('config').write('{"apikey": "a')
+    assert not GlobalConfig().loaded
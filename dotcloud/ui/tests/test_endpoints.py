@@ -0,0 +1,27 @@
+import time
+
+from dotcloud.ui.endpoints import EndpointCache
+
+def test_endpoint_cache(tmpdir):
+    cache = EndpointCache(str(tmpdir.join('endpoints')), ttl=60)
+    assert cache.get('app', 'default', 'www') is None
+    cache.store('app', 'default', 'www', ['ssh://a:1', None])
+    cache.store('app', 'default', 'db', ['ssh://b:2'])
+    cache.store('app', 'staging', 'www', ['ssh://c:3'])
+    assert cache.get('app', 'default', 'www') == ['ssh://a:1', None]
+
+    cache.invalidate('app', 'default', 'www')
+    assert cache.get('app', 'default', 'www') is None
+    assert cache.get('app', 'default', 'db') == ['ssh://b:2']
+    cache.invalidate('app', 'default')
+    assert cache.get('app', 'default', 'db') is None
+    assert cache.get('app', 'staging', 'www') == ['ssh://c:3']
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get('app', 'staging', 'www') is None
+
+def test_endpoint_cache_needs_the_app_directory(tmpdir):
+    cache = EndpointCache(str(tmpdir.join('missing', 'endpoints')))
+    cache.store('app', 'default', 'www', ['ssh://a:1'])
+    assert cache.get('app', 'default', 'www') is None
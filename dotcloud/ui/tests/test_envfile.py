@@ -0,0 +1,46 @@
+import json
+
+from dotcloud.ui import envfile
+
+def test_parse():
+    lines = [
+        '# comment\n',
+        '\n',
+        'A=1\n',
+        'export B = x=y # trailing\n',
+        "C='a # b'\n",
+        'D="line\\nbreak"\n',
+        'E=\n',
+    ]
+    assert list(envfile.parse(lines)) == [
+        ('A', '1'), ('B', 'x=y'), ('C', 'a # b'), ('D', 'line\nbreak'), ('E', '')
+    ]
+
+def test_parse_error():
+    try:
+        list(envfile.parse(['A=1\n', 'oops\n']))
+        assert False
+    except ValueError, e:
+        assert 'Line 2' in str(e)
+
+def test_non_ascii_values():
+    pairs = list(envfile.parse(['A=caf\xc3\xa9\n']))
+    assert pairs == [(u'A', u'caf\xe9')]
+    assert envfile.split_pair('B=caf\xc3\xa9') == (u'B', u'caf\xe9')
+    assert envfile.diff({u'A': u'caf\xe9'}, dict(pairs)) == {}
+
+def test_diff():
+    current = {'A': '1', 'B': '2', 'C': '3'}
+    wanted = {'A': '1', 'B': 'two', 'D': '4'}
+    assert envfile.diff(current, wanted) == {'B': 'two', 'D': '4'}
+    assert envfile.diff(current, wanted, prune=True) == {'B': 'two', 'D': '4', 'C': None}
+    assert envfile.diff(current, {'A': '1'}) == {}
+
+def test_chunks():
+    patch = dict(('VAR{0}'.format(i), 'x' * 100) for i in range(100))
+    chunks = list(envfile.chunks(patch, max_size=1000))
+    assert all(len(json.dumps(c)) <= 1000 for c in chunks)
+    merged = {}
+    for c in chunks:
+        merged.update(c)
+    assert merged == patch
@@ -0,0 +1,45 @@
+from dotcloud.client.response import BaseResponse
+from dotcloud.ui.follow import AdaptiveInterval, LogFormatter, follow, follow_batches
+
+class FakeClient(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    def page(self, n):
+        links = [{'rel': 'next', 'href': n + 1}] if n + 1 < len(self.pages) else []
+        return BaseResponse.create(data={'objects': self.pages[n], 'links': links})
+
+    def stream(self, url):
+        return self.page(0)
+
+    def get(self, url, memo=True):
+        assert not memo
+        return self.page(url)
+
+def test_adaptive_interval():
+    interval = AdaptiveInterval(minimum=1, maximum=3)
+    assert [interval.update(n) for n in (0, 0, 0, 5, 0)] == [2, 3, 3, 1, 2]
+
+def test_follow_pages():
+    sleeps = []
+    client = FakeClient([[1, 2], [], [], [3]])
+    items = list(follow(client, 'url', AdaptiveInterval(1, 8), sleep=sleeps.append))
+    assert items == [1, 2, 3]
+    assert sleeps == [1, 2, 4]
+
+def test_follow_cursor():
+    cursors = []
+    client = FakeClient([[1, 2], [], [3]])
+    batches = follow_batches(client, 0, sleep=lambda s: None, cursor=cursors.append)
+    assert next(batches) == [1, 2]
+    assert cursors == []
+    assert list(batches) == [[3]]
+    assert cursors == [1, 2, None]
+
+def test_log_formatter():
+    formatter = LogFormatter()
+    lines = formatter.format([
+        {'timestamp': 3600.5, 'message': u'caf\xe9'},
+        {'timestamp': 3601, 'source': 'www', 'message': 'ok'}
+    ])
+    assert lines == '01:00:00 --> caf\xc3\xa9\n01:00:01 [www] ok\n'
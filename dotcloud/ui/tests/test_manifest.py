@@ -0,0 +1,27 @@
+import os
+
+from dotcloud.ui import manifest
+
+def test_is_excluded():
+    patterns = ['*.pyc', '/build', 'docs/*.tmp', 'cache/']
+    assert manifest.is_excluded('a/b.pyc', False, patterns)
+    assert manifest.is_excluded('build', True, patterns)
+    assert not manifest.is_excluded('src/build', True, patterns)
+    assert manifest.is_excluded('src/docs/x.tmp', False, patterns)
+    assert manifest.is_excluded('src/cache', True, patterns)
+    assert not manifest.is_excluded('src/cache', False, patterns)
+
+def test_scan_and_diff(tmpdir):
+    tmpdir.join('a.py').write('a')
+    tmpdir.mkdir('src').join('b.py').write('b')
+    tmpdir.join('c.pyc').write('c')
+    root = str(tmpdir)
+    first = manifest.scan(root, ['*.pyc'])
+    assert sorted(first) == ['a.py', 'src', os.path.join('src', 'b.py')]
+    assert manifest.diff(first, manifest.scan(root, ['*.pyc'], first)) == ([], [])
+
+    tmpdir.join('a.py').write('changed')
+    tmpdir.join('src', 'b.py').remove()
+    changed, removed = manifest.diff(first, manifest.scan(root, ['*.pyc'], first))
+    assert changed == ['a.py']
+    assert removed == [os.path.join('src', 'b.py')]
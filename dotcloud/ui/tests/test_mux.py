@@ -0,0 +1,19 @@
+import os
+import socket
+
+from dotcloud.ui import mux
+
+def test_control_sockets(tmpdir):
+    directory = str(tmpdir.join('ssh'))
+    options = mux.control_options(directory, persist=60)
+    assert os.path.isdir(directory)
+    assert 'ControlPath={0}/%r@%h:%p'.format(directory) in options
+    assert 'ControlPersist=60' in options
+
+    tmpdir.join('ssh', 'not-a-socket').write('')
+    sock = socket.socket(socket.AF_UNIX)
+    sock.bind(os.path.join(directory, 'dotcloud@host:2222'))
+    try:
+        assert [name for name, path in mux.masters(directory)] == ['dotcloud@host:2222']
+    finally:
+        sock.close()
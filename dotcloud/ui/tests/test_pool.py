@@ -0,0 +1,27 @@
+from dotcloud.client.pool import ConnectionPool
+
+class FakeConnection(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_reuse_idle_connection():
+    pool = ConnectionPool(maxsize=1)
+    conn, reused = pool.acquire('host', FakeConnection)
+    assert not reused
+    pool.release('host', conn)
+    again, reused = pool.acquire('host', FakeConnection)
+    assert reused and again is conn
+    assert pool.stats['created'] == 1 and pool.stats['reused'] == 1
+
+def test_idle_timeout_and_maxsize():
+    pool = ConnectionPool(maxsize=1, idle_timeout=0)
+    first, _ = pool.acquire('host', FakeConnection)
+    second, _ = pool.acquire('host', FakeConnection)
+    pool.release('host', first)
+    pool.release('host', second)
+    assert second.closed
+    third, reused = pool.acquire('host', FakeConnection)
+    assert not reused and first.closed
+    assert pool.stats['discarded'] == 2
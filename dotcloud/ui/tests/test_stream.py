@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import json
+
+from dotcloud.client.stream import StreamDecoder
+
+def reader(body, size):
+    chunks = [body[i:i + size] for i in range(0, len(body), size)]
+    return lambda: chunks.pop(0) if chunks else ''
+
+def decode(data, size):
+    decoder = StreamDecoder(reader(json.dumps(data), size))
+    in_array = decoder.start()
+    items = list(decoder)
+    return in_array, items, decoder.rest
+
+def test_decode_items_across_chunks():
+    data = {'links': [{'rel': 'next', 'href': '/x'}],
+            'objects': [12345, {'name': u'caf\xe9', 'n': [1, 2.5]}, 'a', None, True],
+            'count': 678}
+    for size in (1, 3, 7, 4096):
+        in_array, items, rest = decode(data, size)
+        assert in_array
+        assert items == data['objects']
+        assert rest == {'links': data['links'], 'count': 678}
+
+def test_decode_without_array():
+    assert decode({'object': {'a': 1}}, 2) == (False, [], {'object': {'a': 1}})
+    assert decode({'objects': []}, 2) == (True, [], {})